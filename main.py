@@ -10,15 +10,13 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from src.schedulers.cron_jobs import booking_job, send_remainder
+from src.logs import setup_logging
+from src.profiling import install_signal_handler
+from src.schedulers.cron_jobs import booking_job, send_remainder, work_queue
+from src.status import serve
 
 http.client._MAXHEADERS = 1000  # type: ignore
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(module)s - %(funcName)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-logging.getLogger("apscheduler").setLevel(logging.ERROR)
+setup_logging()
 
 # Cron info
 HOUR = int(os.getenv("HOUR", 0))
@@ -29,6 +27,7 @@ JITTER = int(os.getenv("JITTER", 0))
 
 if __name__ == "__main__":
     logging.info("Rainbot started")
+    install_signal_handler()
     offset = pytz.timezone("Europe/Paris").utcoffset(datetime.now()).total_seconds()
     scheduler = BlockingScheduler()
     scheduler.add_job(
@@ -39,4 +38,5 @@ if __name__ == "__main__":
             booking_job, "cron", hour=int(8 - offset // 3600), second=second, jitter=JITTER
         )
     scheduler.add_job(send_remainder, "cron", hour=int(2 - offset // 3600))
+    serve(scheduler, work_queue)
     scheduler.start()
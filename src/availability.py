@@ -0,0 +1,105 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+from src.places import normalise
+from src.utils import state_path
+
+# Seconds a search result is served from the cache, 0 disables it
+AVAILABILITY_TTL = float(os.getenv("AVAILABILITY_TTL", 12))
+# Empty results expire sooner so that courts released at 8:00 are seen as soon as possible
+AVAILABILITY_EMPTY_TTL = float(os.getenv("AVAILABILITY_EMPTY_TTL", 1))
+# Sequence number, key digest, expiry timestamp and payload length of a slot
+HEADER = struct.Struct("<Q16sdI")
+
+
+def query_key(places, match_day, in_out, hour_from, hour_to, *_, **__):
+    """Key of a court search, the same for the searches returning the same courts."""
+    return json.dumps(
+        [
+            sorted({normalise(place) for place in places}),
+            str(match_day),
+            sorted(in_out or []),
+            int(hour_from),
+            int(hour_to),
+        ]
+    )
+
+
+class AvailabilityCache:
+    """
+    Court search results shared by all the processes of a host through a memory-mapped file.
+
+    The file is a fixed table of slots indexed by the hash of the query key, a newer entry
+    replacing an older one hashed to the same slot. Writers take a lock on the file, readers
+    do not: a slot carries a sequence number that is odd while it is written, and a read that
+    saw it change is a miss.
+    """
+
+    def __init__(self, path=None, slots=1024, slot_size=2048):
+        """
+        Args:
+            path (str): cache file, defaults to availability.cache in the state directory
+            slots (int): number of entries the cache holds at most
+            slot_size (int): bytes of a slot, larger results are not cached
+        """
+        self.path = path or state_path("availability.cache")
+        self.slots = slots
+        self.slot_size = slot_size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != slots * slot_size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, slots * slot_size)
+            # Shared mapping, inherited by forked workers
+            self._map = mmap.mmap(fd, slots * slot_size)
+        finally:
+            # The mapping holds a duplicate of fd, closing fd alone would keep the file locked
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        return digest, int.from_bytes(digest[:8], "little") % self.slots * self.slot_size
+
+    def get(self, key):
+        """
+        Returns:
+            list: cached (place, hour) slots of the query, None on a miss
+        """
+        digest, offset = self._locate(key)
+        sequence, slot_digest, expires_at, length = HEADER.unpack_from(self._map, offset)
+        if sequence % 2 or slot_digest != digest or expires_at < time.time():
+            return None
+        payload = self._map[offset + HEADER.size : offset + HEADER.size + length]
+        if HEADER.unpack_from(self._map, offset)[0] != sequence:
+            return None
+        return [tuple(slot) for slot in json.loads(payload)]
+
+    def _write(self, key, payload, expires_at):
+        digest, offset = self._locate(key)
+        with open(self.path, "rb") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            sequence = HEADER.unpack_from(self._map, offset)[0]
+            HEADER.pack_into(self._map, offset, sequence + 1, digest, 0, 0)
+            self._map[offset + HEADER.size : offset + HEADER.size + len(payload)] = payload
+            HEADER.pack_into(self._map, offset, sequence + 2, digest, expires_at, len(payload))
+
+    def put(self, key, slots):
+        if not AVAILABILITY_TTL:
+            return
+        payload = json.dumps(slots).encode()
+        if len(payload) > self.slot_size - HEADER.size:
+            return
+        ttl = AVAILABILITY_TTL if slots else AVAILABILITY_EMPTY_TTL
+        self._write(key, payload, time.time() + ttl)
+
+    def invalidate(self, key):
+        """Drop the cached result of the query, once a booking changed what it returns."""
+        if self.get(key) is not None:
+            self._write(key, b"", 0)
@@ -1,9 +1,11 @@
+import json
 import logging
 import os
+import shutil
 import tempfile
 import time
-from datetime import datetime
 from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse
 
 import requests
 from bs4 import BeautifulSoup
@@ -18,6 +20,10 @@ from selenium.webdriver.support.ui import WebDriverWait
 from twocaptcha import TwoCaptcha
 from webdriver_manager.chrome import ChromeDriverManager
 
+from src.places import PlaceIndex
+from src.status import report_phase
+from src.throttle import throttle
+
 load_dotenv()
 BOOKING_URL = os.environ["BOOKING_URL"]
 LOGIN_URL = os.environ["LOGIN_URL"]
@@ -26,15 +32,91 @@ ACCOUNT_BASE_URL = os.environ["ACCOUNT_BASE_URL"]
 CAPTCHA_URL = os.environ["CAPTCHA_URL"]
 CAPTCHA_API_KEY = os.environ["CAPTCHA_API_KEY"]
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler()],
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
 )
+# Lean browsing: headless, smaller viewport and no images, fonts, map tiles nor trackers.
+# Images are only blocked on the booking site since the captcha is an image.
+LEAN_BROWSER = os.getenv("LEAN_BROWSER", "false").lower() == "true"
+BOOKING_HOST = urlparse(BOOKING_URL).netloc
+BLOCKED_URLS = os.getenv(
+    "BLOCKED_URLS",
+    ",".join(
+        [
+            *[f"*{BOOKING_HOST}*.{ext}" for ext in ["png", "jpg", "jpeg", "gif", "svg", "webp"]],
+            *[f"*.{ext}*" for ext in ["woff", "woff2", "ttf", "otf", "eot"]],
+            "*fonts.googleapis.com*",
+            "*tile.openstreetmap.org*",
+            "*google-analytics.com*",
+            "*googletagmanager.com*",
+            "*doubleclick.net*",
+            "*facebook.net*",
+            "*hotjar.com*",
+            "*xiti.com*",
+        ]
+    ),
+).split(",")
+NO_ANIMATIONS_SCRIPT = """
+document.addEventListener("DOMContentLoaded", function () {
+    var style = document.createElement("style");
+    style.textContent = "*, *::before, *::after "
+        + "{ transition: none !important; animation: none !important; }";
+    document.head.appendChild(style);
+    if (window.jQuery) { window.jQuery.fx.off = true; }
+});
+"""
+
 logger = logging.getLogger(__name__)
 
 
+def chrome_arguments():
+    """Command line arguments of the booking browsers, apart from their profile directory."""
+    arguments = [
+        "--no-sandbox",
+        "--disable-dev-shm-usage",
+        "--disable-gpu",
+        f"--user-agent={USER_AGENT}",
+    ]
+    if LEAN_BROWSER:
+        arguments += [
+            "--headless=new",
+            "--window-size=1280,800",
+            "--disable-extensions",
+            "--force-prefers-reduced-motion",
+        ]
+    else:
+        arguments += ["--window-size=1920,1080"]
+    return arguments
+
+
+def search_data(places, match_day, in_out, hour_from, hour_to):
+    """Fields of the court search form, see BookingService.find_all_courts_without_login."""
+    return {
+        "where": places,
+        "selWhereTennisName": places,
+        "when": match_day,
+        "selCoating": ["96", "2095", "94", "1324", "2016", "92"],
+        "selInOut": in_out,
+        "hourRange": f"{int(hour_from)}-{int(hour_to)}",
+    }
+
+
+def post_search(search_data):
+    response = requests.post(
+        BOOKING_URL,
+        search_data,
+        params={"page": "recherche", "action": "rechercher_creneau"},
+        timeout=10,
+    )
+    response.raise_for_status()
+    return response
+
+
 class BookingService:
+    # Set from the Tennis catalog by the scheduler before workers are forked
+    place_index = None
+
     def __init__(self):
         self._username = None
         self._is_booking = False
@@ -44,21 +126,35 @@ class BookingService:
 
     def _setup_driver(self):
         """Set up the Selenium WebDriver with appropriate options for visible operation."""
-        temp_dir = tempfile.mkdtemp()
+        self._user_data_dir = tempfile.mkdtemp()
         chrome_options = Options()
-        chrome_options.add_argument(f"--user-data-dir={temp_dir}")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument(
-            "--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
-        )
+        chrome_options.add_argument(f"--user-data-dir={self._user_data_dir}")
+        for argument in chrome_arguments():
+            chrome_options.add_argument(argument)
 
         # Set Chrome binary location for macOS
         if os.environ.get("GOOGLE_CHROME_BIN"):
             chrome_options.binary_location = os.environ["GOOGLE_CHROME_BIN"]
 
+        try:
+            self._start_driver(chrome_options)
+        except Exception:
+            # logout is never called on a service that failed to start
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
+            raise
+
+    def _start_driver(self, chrome_options, window=None):
+        """
+        Args:
+            chrome_options (Options): options of the browser or of the session to attach to it
+            window (str): handle of the window to drive, the first one by default
+        """
+        if LEAN_BROWSER:
+            # Return from driver.get at DOMContentLoaded, elements are waited for explicitly
+            chrome_options.page_load_strategy = "eager"
+            chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+        self.driver = None
         try:
             if os.environ.get("CHROMEDRIVER_PATH"):
                 service = Service(os.environ["CHROMEDRIVER_PATH"])
@@ -69,18 +165,29 @@ class BookingService:
                 service = Service(driver_path)
 
             self.driver = webdriver.Chrome(service=service, options=chrome_options)
+            if window is not None:
+                WebDriverWait(self.driver, 10).until(lambda d: window in d.window_handles)
+                self.driver.switch_to.window(window)
 
             # Set page load timeout
             self.driver.set_page_load_timeout(30)
             self.wait = WebDriverWait(self.driver, 10)
+            if LEAN_BROWSER:
+                self.driver.execute_cdp_cmd("Network.enable", {})
+                self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+                self.driver.execute_cdp_cmd(
+                    "Page.addScriptToEvaluateOnNewDocument", {"source": NO_ANIMATIONS_SCRIPT}
+                )
             logger.info("WebDriver initialized successfully")
 
         except Exception as e:
             logger.error(f"Failed to initialize WebDriver: {str(e)}")
+            if self.driver is not None:
+                self.driver.quit()
             raise
 
-    @staticmethod
-    def find_courts_without_login(places, match_day, in_out, hour_from, hour_to, *_, **__):
+    @classmethod
+    def find_all_courts_without_login(cls, places, match_day, in_out, hour_from, hour_to, *_, **__):
         """
         Args:
             places (list): places where to look spot in
@@ -88,33 +195,25 @@ class BookingService:
             in_out (list): containing V, F both or None
             hour_from (str): beginning of the spot
             hour_to (str): end of the spot
+
+        Returns:
+            list: available (place, hour) slots, in the order of the search results
         """
-        search_data = {
-            "where": places,
-            "selWhereTennisName": places,
-            "when": match_day,
-            "selCoating": ["96", "2095", "94", "1324", "2016", "92"],
-            "selInOut": in_out,
-            "hourRange": f"{int(hour_from)}-{int(hour_to)}",
-        }
-        response = requests.post(
-            BOOKING_URL,
-            search_data,
-            params={"page": "recherche", "action": "rechercher_creneau"},
-            timeout=10,
+        response = throttle.call(
+            "booking", post_search, search_data(places, match_day, in_out, hour_from, hour_to)
         )
         soup = BeautifulSoup(response.text, features="html5lib")
-        courts = [court for court in soup.find_all("h4", {"class": "panel-title"})]
-        if not courts:
-            return None, None
-        court = courts[0]
-        place = [
-            p
-            for p in places
-            if p.replace(" ", "")
-            == court.find_parent("div", attrs={"role": "tabpanel"}).attrs["id"]
-        ][0]
-        return place, int(court.text[:2])
+        place_index = cls.place_index or PlaceIndex(places)
+        slots = [
+            (
+                place_index.resolve(
+                    court.find_parent("div", attrs={"role": "tabpanel"}).attrs["id"]
+                ),
+                int(court.text[:2]),
+            )
+            for court in soup.find_all("h4", {"class": "panel-title"})
+        ]
+        return list(dict.fromkeys(slot for slot in slots if slot[0] is not None))
 
     def book_court(
         self,
@@ -128,16 +227,34 @@ class BookingService:
         partenaire_first_name,
         partenaire_last_name,
         *_,
+        race=None,
         **__,
     ):
+        """
+        Book a court through the browser.
+
+        Args:
+            race (Race): set when several attempts are made in parallel for the same request,
+                only the first one to reach the confirmation goes on
+
+        Returns:
+            str: "booked", "lost" when the slot is gone, "already_booked", or "cancelled" when
+            another attempt of the race won
+        """
+        report_phase("login")
         self.login(username, password)
         self.driver.save_screenshot("after_login.png")
         if self.has_booking():
             logger.info("Already has a booking")
-            return None
+            return "already_booked"
+        if race is not None and race.is_lost(self):
+            return "cancelled"
 
+        report_phase("search")
         self.search_courts(place, match_day, in_out, hour_from, hour_to)
         self.driver.save_screenshot("after_search.png")
+        if race is not None and race.is_lost(self):
+            return "cancelled"
 
         # Wait for the booking button to be present
         try:
@@ -147,7 +264,7 @@ class BookingService:
             )
         except TimeoutException:
             logger.error("buttonAllOk not found")
-            return None
+            return "lost"
 
         booking_buttons = self.driver.find_elements(By.CSS_SELECTOR, "button.buttonAllOk")
         if booking_buttons:
@@ -155,9 +272,12 @@ class BookingService:
             time.sleep(0.5)
         else:
             logger.error("No booking buttons found")
-            return None
+            return "lost"
+        if race is not None and race.is_lost(self):
+            return "cancelled"
 
         # Solve captcha
+        report_phase("captcha")
         logger.info("Solving captcha")
         try:
             self.driver.save_screenshot("before_solving_captcha.png")
@@ -180,6 +300,12 @@ class BookingService:
             logger.error(f"Error filling player details: {str(e)}")
             raise
 
+        # Only one attempt of a race may confirm, the site allows a single booking per user
+        if race is not None and not race.claim(self):
+            logger.info("Another attempt is already confirming a booking")
+            return "cancelled"
+
+        report_phase("payment")
         self.driver.save_screenshot("before_clicking_ticket_option.png")
         ticket_option = self.driver.find_element(By.ID, "submitControle")
         ticket_option.click()
@@ -206,18 +332,19 @@ class BookingService:
 
         message = f"Court successfully paid for {username}"
         logger.log(logging.INFO, message)
+        return "booked"
 
     def login(self, username, password):
         """Log in to the booking system."""
         # Navigate to login page
-        logger.info(f"Navigating to login page: {LOGIN_URL}")
+        logger.debug(f"Navigating to login page: {LOGIN_URL}")
         self.driver.get(LOGIN_URL)
 
         # Wait for login form to load
-        logger.info("Waiting for login form to load")
+        logger.debug("Waiting for login form to load")
         try:
             self.wait.until(EC.presence_of_element_located((By.ID, "form-login")))
-            logger.info("Login form loaded successfully")
+            logger.debug("Login form loaded successfully")
         except TimeoutException:
             logger.error("Login form not found and not already logged in")
             raise
@@ -227,23 +354,23 @@ class BookingService:
         password_input = self.driver.find_element(By.NAME, "password")
 
         # Clear the username field and type the username
-        logger.info(f"Entering username: {username}")
+        logger.debug(f"Entering username: {username}")
         username_input.clear()
         username_input.send_keys(username)
 
         # Clear the password field and type the password
-        logger.info("Entering password")
+        logger.debug("Entering password")
         password_input.clear()
         password_input.send_keys(password)
 
         # Find the submit button
         submit_button = self.driver.find_element(By.XPATH, "//button[@type='submit']")
-        logger.info("Found submit button")
+        logger.debug("Found submit button")
 
         # Click the submit button
-        logger.info("Clicking submit button")
+        logger.debug("Clicking submit button")
         submit_button.click()
-        logger.info("Clicked submit button")
+        logger.debug("Clicked submit button")
 
     def solve_captcha(self):
         self.driver.switch_to.default_content()
@@ -269,9 +396,11 @@ class BookingService:
         image_file = NamedTemporaryFile(suffix=".png", delete=False)
         captcha_div.screenshot(image_file.name)
         solver = TwoCaptcha(CAPTCHA_API_KEY)
-        logger.info("Solving captcha")
-        result = solver.normal(image_file.name)
-        logger.info(f"Captcha solved: {result['code']}")
+        logger.debug("Solving captcha")
+        result = throttle.call(
+            "captcha", solver.normal, image_file.name, retries=1, retry_on=(Exception,)
+        )
+        logger.debug(f"Captcha solved: {result['code']}")
         captcha_input = self.driver.find_element(By.ID, "li-antibot-answer")
         captcha_input.clear()
         captcha_input.send_keys(result["code"])
@@ -280,8 +409,38 @@ class BookingService:
 
         self.driver.switch_to.default_content()
 
+    def network_usage(self):
+        """
+        Count the requests and bytes of the session since the last call, from the performance log.
+
+        Returns:
+            dict: loaded requests and bytes, and requests blocked by BLOCKED_URLS
+        """
+        usage = {"requests": 0, "bytes": 0, "blocked_requests": 0}
+        for entry in self.driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            if message["method"] == "Network.loadingFinished":
+                usage["requests"] += 1
+                usage["bytes"] += message["params"].get("encodedDataLength", 0)
+            elif message["method"] == "Network.loadingFailed" and message["params"].get(
+                "blockedReason"
+            ):
+                usage["blocked_requests"] += 1
+        return usage
+
     def logout(self):
+        if LEAN_BROWSER:
+            try:
+                usage = self.network_usage()
+                logger.info(
+                    f"Loaded {usage['requests']} requests ({usage['bytes'] / 1024:.0f} kB), "
+                    f"saved {usage['blocked_requests']} blocked requests"
+                )
+            except Exception as e:
+                logger.warning(f"Could not read network usage: {str(e)}")
         self.driver.quit()
+        if self._user_data_dir:
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
 
     def fill_player_details(self, name, surname, email=None):
         """
@@ -298,13 +457,13 @@ class BookingService:
         )
         name_input.clear()
         name_input.send_keys(name)
-        logger.info(f"Filled name: {name}")
+        logger.debug(f"Filled name: {name}")
 
         # Locate the surname input field within the 'firstname' div and fill it
         surname_input = self.driver.find_element(By.CSS_SELECTOR, "div.name input[name='player1']")
         surname_input.clear()
         surname_input.send_keys(surname)
-        logger.info(f"Filled surname: {surname}")
+        logger.debug(f"Filled surname: {surname}")
 
         # Locate the email input field within the 'email' div and fill it
         if email:
@@ -313,355 +472,39 @@ class BookingService:
             )
             email_input.clear()
             email_input.send_keys(email)
-            logger.info(f"Filled email: {email}")
+            logger.debug(f"Filled email: {email}")
 
     def search_courts(self, place, match_day, in_out, hour_from, hour_to):
-        self.driver.get(f"{BOOKING_URL}?page=recherche&view=recherche_creneau")
-        time.sleep(1)
-        self.driver.save_screenshot("after_navigating_to_booking_page.png")
-
-        # First, check for and close the initial modal popup
-        try:
-            # Wait for the modal to appear
-            WebDriverWait(self.driver, 1).until(
-                EC.presence_of_element_located((By.ID, "closePopup"))
-            )
-
-            # Find and click the close button or the "Je continue" button
-            try:
-                close_button = self.driver.find_element(By.ID, "closePopup")
-                logger.info("Found closePopup button, clicking it")
-                self.driver.execute_script("arguments[0].click();", close_button)
-            except NoSuchElementException:
-                try:
-                    continue_button = self.driver.find_element(By.CSS_SELECTOR, ".popin.ignore")
-                    logger.info("Found 'Je continue' button, clicking it")
-                    self.driver.execute_script("arguments[0].click();", continue_button)
-                except NoSuchElementException:
-                    logger.warning("Could not find close or continue button on initial modal")
-
-            # Wait for the modal to disappear
-            time.sleep(1)
-
-        except TimeoutException:
-            logger.info("No initial modal popup found")
-
-        # Wait for the search form to load
-        # self.wait.until(EC.presence_of_element_located((By.NAME, "when")))
-
-        # Check for and close any other modal dialogs
-        try:
-            modal = self.driver.find_element(By.ID, "confirmModalGeneral")
-            if modal.is_displayed():
-                logger.info("Modal dialog found, attempting to close it")
-                close_button = self.driver.find_element(
-                    By.CSS_SELECTOR, "#confirmModalGeneral .close"
-                )
-                self.driver.execute_script("arguments[0].click();", close_button)
-                time.sleep(1)  # Wait for modal to close
-        except NoSuchElementException:
-            logger.info("No additional modal dialog found")
-
-        # =====================================================================
-        # PLACE SELECTION
-        # =====================================================================
-
-        # First, find the token input field - this is where we type
-        token_input = self.driver.find_element(By.CSS_SELECTOR, "#whereToken .tokens-input-text")
-        logger.info("Found token input field")
-
-        # Clear any existing tokens first
-        token_list = self.driver.find_element(By.ID, "whereToken")
-        token_items = token_list.find_elements(By.CSS_SELECTOR, "li.tokens-list-token-holder")
-
-        logger.info(f"Found {len(token_items)} existing tokens, removing them")
-        for token in token_items:
-            try:
-                close_btn = token.find_element(By.CSS_SELECTOR, "span.tokens-delete-token")
-                close_btn.click()  # Use normal click for human-like behavior
-                logger.info("Removed a token")
-                time.sleep(0.5)  # Small delay between removals
-            except:
-                logger.warning("Failed to remove a token")
-
-        # Now add each place one by one, exactly as a human would
-        logger.info(f"Adding place: {place}")
-
-        # Focus on the input field
-        token_input.click()
-        time.sleep(0.2)
-
-        # Clear any existing text
-        token_input.clear()
-        time.sleep(0.2)
-
-        # Type the place name character by character with small delays
-        for char in place:
-            token_input.send_keys(char)
-
-        # Wait for suggestions to appear - reduced wait time
-        time.sleep(0.5)
-
-        # Look for suggestions with the EXACT correct selector
-        suggestions = self.driver.find_elements(
-            By.CSS_SELECTOR, "li.tokens-suggestions-list-element"
-        )
-
-        logger.info(f"Found {len(suggestions)} suggestions for {place}")
-
-        # Log the text of each suggestion for debugging
-        for i, suggestion in enumerate(suggestions):
-            try:
-                suggestion_text = suggestion.text
-                logger.info(f"Suggestion {i+1}: '{suggestion_text}'")
-
-                # If this suggestion matches our place name, prioritize clicking it
-                if place.lower() in suggestion_text.lower():
-                    logger.info(f"Found matching suggestion: '{suggestion_text}'")
-                    target_suggestion = suggestion
-                    break
-            except:
-                logger.warning(f"Could not get text for suggestion {i+1}")
-        else:
-            # If no match found, use the first suggestion
-            target_suggestion = suggestions[0]
-            logger.info(f"Using first suggestion by default")
-
-        # Click the suggestion
-        target_suggestion.click()
-        logger.info(f"Clicked on suggestion for {place}")
-
-        # Wait for the token to be added - reduced wait time
-        time.sleep(0.3)
-
-        # Verify the token was added
-        current_tokens = self.driver.find_elements(
-            By.CSS_SELECTOR, "#whereToken li.tokens-list-token-holder"
-        )
-        logger.info(f"Current token count: {len(current_tokens)}")
-
-        # =====================================================================
-        # DATE SELECTION
-        # =====================================================================
-
-        # Set date
-        logger.info(f"Setting date to: {match_day}")
-        # The visible date input is readonly, but there's a hidden input that actually holds the value
-        # First find both inputs
-        visible_date_input = self.driver.find_element(By.ID, "when")
-        hidden_date_input = self.driver.find_element(By.ID, "whenIso")
-
-        logger.info(
-            f"Found date inputs - visible: {visible_date_input.get_attribute('value')}, hidden: {hidden_date_input.get_attribute('value')}"
-        )
-
-        # Set the hidden input value directly using JavaScript
-        self.driver.execute_script(f"document.getElementById('whenIso').value = '{match_day}';")
-        logger.info(f"Set hidden date input value to {match_day}")
-
-        # Also update the visible input for consistency
-        # First get the formatted date (assuming match_day is in DD/MM/YYYY format)
-        try:
-            # Convert to a more readable format for the visible field
-            date_obj = datetime.strptime(match_day, "%d/%m/%Y")
-            formatted_date = date_obj.strftime("%A %d %B %Y")
-
-            # Set the visible date
-            self.driver.execute_script(
-                f"document.getElementById('when').value = '{formatted_date}';"
-            )
-            logger.info(f"Set visible date input to {formatted_date}")
-        except Exception as e:
-            logger.warning(f"Could not format visible date: {str(e)}")
+        """
+        Submit the search form of the booking site from the page context, in a single navigation.
 
-        # Trigger change events on both inputs to ensure the site recognizes the change
+        The form is posted with the same fields as find_all_courts_without_login so that the
+        session lands directly on the results with their booking buttons.
+        """
+        token = self.place_index.token(place) if self.place_index else None
+        logger.info(f"Searching {token or place} on {match_day} from {hour_from} to {hour_to}")
+        page = self.driver.find_element(By.TAG_NAME, "html")
         self.driver.execute_script(
             """
-            var hiddenInput = document.getElementById('whenIso');
-            var visibleInput = document.getElementById('when');
-
-            // Create and dispatch change events
-            var event = new Event('change', { 'bubbles': true });
-            hiddenInput.dispatchEvent(event);
-            visibleInput.dispatchEvent(event);
-        """
+            var form = document.createElement("form");
+            form.method = "POST";
+            form.action = arguments[0];
+            Object.entries(arguments[1]).forEach(function (field) {
+                [].concat(field[1]).forEach(function (value) {
+                    var input = document.createElement("input");
+                    input.type = "hidden";
+                    input.name = field[0];
+                    input.value = value;
+                    form.appendChild(input);
+                });
+            });
+            document.body.appendChild(form);
+            form.submit();
+            """,
+            f"{BOOKING_URL}?page=recherche&action=rechercher_creneau",
+            search_data([token or place], match_day, in_out, hour_from, hour_to),
         )
-        logger.info("Triggered change events on date inputs")
-
-        # =====================================================================
-        # INDOOR/OUTDOOR SELECTION
-        # =====================================================================
-
-        # Set in/out options (surface type)
-        logger.info(f"Setting in/out options (surface type): {in_out}")
-        # First click the dropdown button to open it
-        dropdown_button = self.driver.find_element(By.ID, "dropdownTerrain")
-        logger.info("Found dropdown button for terrain selection")
-
-        # Click to open the dropdown
-        dropdown_button.click()
-        logger.info("Clicked dropdown button to open terrain options")
-        time.sleep(0.3)
-
-        # Now find the checkboxes inside the dropdown
-        checkboxes = self.driver.find_elements(By.CSS_SELECTOR, "input[name='selInOut']")
-        logger.info(f"Found {len(checkboxes)} terrain checkboxes")
-
-        # Log the current state of checkboxes
-        for i, checkbox in enumerate(checkboxes):
-            value = checkbox.get_attribute("value")
-            id_attr = checkbox.get_attribute("id")
-            checked = checkbox.is_selected()
-            logger.info(f"Terrain checkbox {i+1}: id={id_attr}, value={value}, checked={checked}")
-
-        # We want to ensure only the options in in_out are checked
-        for checkbox in checkboxes:
-            value = checkbox.get_attribute("value")
-            should_check = value in in_out
-            is_checked = checkbox.is_selected()
-
-            if should_check != is_checked:
-                # Need to change the state
-                try:
-                    # Find the parent label and click it (more reliable than clicking the checkbox directly)
-                    label = self.driver.find_element(
-                        By.CSS_SELECTOR, f"label[for='{checkbox.get_attribute('id')}']"
-                    )
-                    label.click()
-                    logger.info(
-                        f"Clicked label for checkbox with value {value} to {'check' if should_check else 'uncheck'} it"
-                    )
-                    time.sleep(0.2)
-                except Exception as e:
-                    logger.warning(f"Could not click label: {str(e)}, trying direct checkbox click")
-                    try:
-                        # Try clicking the checkbox directly
-                        checkbox.click()
-                        logger.info(f"Clicked checkbox with value {value} directly")
-                        time.sleep(0.2)
-                    except Exception as e2:
-                        logger.warning(f"Direct click failed: {str(e2)}, trying JavaScript")
-                        # If direct click fails, try JavaScript
-                        self.driver.execute_script(
-                            "arguments[0].checked = arguments[1];", checkbox, should_check
-                        )
-                        logger.info(
-                            f"Set checkbox with value {value} to {should_check} using JavaScript"
-                        )
-
-        # Click elsewhere to close the dropdown
-        self.driver.find_element(By.TAG_NAME, "body").click()
-        time.sleep(0.3)
-
-        # =====================================================================
-        # HOUR RANGE SELECTION
-        # =====================================================================
-
-        # Set hour range
-        logger.info(f"Setting hour range: {hour_from} - {hour_to}")
-        # Convert hour strings to integers for comparison
-        hour_from_int = int(hour_from.split(":")[0] if ":" in hour_from else hour_from)
-        hour_to_int = int(hour_to.split(":")[0] if ":" in hour_to else hour_to)
-
-        # Find the slider element with the correct ID
-        slider = self.driver.find_element(By.ID, "slider")
-        logger.info("Found slider element with ID 'slider'")
-
-        # Get the slider handles
-        handles = slider.find_elements(By.CSS_SELECTOR, ".ui-slider-handle")
-        if len(handles) >= 2:
-            logger.info(f"Found {len(handles)} slider handles")
-
-            # Get the current values from the tooltips
-            tooltips = self.driver.find_elements(By.CSS_SELECTOR, ".tooltip-inner")
-            if len(tooltips) >= 2:
-                current_from = tooltips[0].text
-                current_to = tooltips[1].text
-                logger.info(f"Current slider range: {current_from} - {current_to}")
-
-        # Calculate the positions based on the available range (8h to 22h = 14 hours)
-        min_hour = 8  # The minimum hour on the slider
-        max_hour = 22  # The maximum hour on the slider
-        total_range = max_hour - min_hour
-
-        # Calculate percentages for the handles
-        from_percent = ((hour_from_int - min_hour) / total_range) * 100
-        to_percent = ((hour_to_int - min_hour) / total_range) * 100
-
-        logger.info(f"Setting slider handles to {from_percent}% and {to_percent}%")
-
-        # Use JavaScript to set the slider values directly
-        js_code = f"""
-        // Set the slider handles
-        var slider = $('#slider');
-        if (slider.slider) {{
-            // Set the values
-            slider.slider('values', 0, {hour_from_int - min_hour});
-            slider.slider('values', 1, {hour_to_int - min_hour});
-
-            // Update the tooltips
-            $('.tooltip1 .tooltip-inner').text('{hour_from_int}h');
-            $('.tooltip2 .tooltip-inner').text('{hour_to_int}h');
-
-            // Update the handle positions
-            $('.ui-slider-handle').eq(0).css('left', '{from_percent}%');
-            $('.ui-slider-handle').eq(1).css('left', '{to_percent}%');
-
-            // Update the range
-            $('.ui-slider-range').css({{
-                'left': '{from_percent}%',
-                'width': '{to_percent - from_percent}%'
-            }});
-
-            console.log('Set slider range to {hour_from_int}h-{hour_to_int}h');
-            return true;
-        }}
-        return false;
-        """
-
-        success = self.driver.execute_script(js_code)
-        if success:
-            logger.info(
-                f"Successfully set hour range using jQuery slider API: {hour_from_int}h - {hour_to_int}h"
-            )
-        else:
-            logger.warning("jQuery slider API not available, trying direct DOM manipulation")
-
-            # Try direct DOM manipulation
-            js_direct = f"""
-            // Set handle positions directly
-            document.querySelectorAll('.ui-slider-handle')[0].style.left = '{from_percent}%';
-            document.querySelectorAll('.ui-slider-handle')[1].style.left = '{to_percent}%';
-
-            // Update tooltips
-            document.querySelector('.tooltip1 .tooltip-inner').textContent = '{hour_from_int}h';
-            document.querySelector('.tooltip2 .tooltip-inner').textContent = '{hour_to_int}h';
-
-            // Update range
-            var range = document.querySelector('.ui-slider-range');
-            range.style.left = '{from_percent}%';
-            range.style.width = '{to_percent - from_percent}%';
-            """
-
-            self.driver.execute_script(js_direct)
-            logger.info(
-                f"Set hour range using direct DOM manipulation: {hour_from_int}h - {hour_to_int}h"
-            )
-
-        # =====================================================================
-        # SUBMIT SEARCH
-        # =====================================================================
-
-        # Add a short pause for manual inspection if need
-        logger.info("Pausing briefly before search...")
-        time.sleep(1.5)
-
-        # Find and click the search button
-        search_button = self.driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
-        logger.info("Clicking search button")
-        search_button.click()
-        time.sleep(2)
-        logger.info("Clicked search button directly")
+        self.wait.until(EC.staleness_of(page))
 
     def has_booking(self):
         self.driver.get(f"{BOOKING_URL}?page=profil&view=ma_reservation")
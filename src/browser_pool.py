@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import requests
+import websocket
+from selenium.webdriver.chrome.options import Options
+
+from src.booking_service import BookingService, chrome_arguments
+from src.utils import memory_usage
+
+logger = logging.getLogger(__name__)
+
+
+def process_tree(pid):
+    """Return pid and the ids of all its descendants, read from /proc (Linux only)."""
+    pids = [pid]
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as children:
+                pids += [int(child) for child in children.read().split()]
+        except FileNotFoundError:
+            continue
+    return pids
+
+
+class SharedBrowser:
+    """
+    A Chrome process hosting the isolated browser contexts of several booking sessions.
+
+    Each context has its own cookies and storage, like a separate Chrome profile, while the
+    browser process, its GPU and network processes and its code pages are shared.
+    """
+
+    def __init__(self):
+        binary = os.environ.get("GOOGLE_CHROME_BIN") or shutil.which("google-chrome")
+        if binary is None:
+            raise RuntimeError("Chrome not found, set GOOGLE_CHROME_BIN to the path of its binary")
+        self.user_data_dir = tempfile.mkdtemp(prefix="rainbot-")
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.process = subprocess.Popen(
+            [
+                binary,
+                f"--remote-debugging-port={self.port}",
+                f"--user-data-dir={self.user_data_dir}",
+                "--no-first-run",
+                *chrome_arguments(),
+                "about:blank",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.pid = self.process.pid
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                version = requests.get(f"http://{self.address}/json/version", timeout=1).json()
+                break
+            except requests.RequestException as e:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise RuntimeError("Shared browser did not start") from e
+                time.sleep(0.2)
+        self._websocket_url = version["webSocketDebuggerUrl"]
+        logger.info(f"Shared browser started on {self.address}")
+
+    def __getstate__(self):
+        # Workers only talk to the browser through its port, the process stays with its parent
+        return {key: value for key, value in self.__dict__.items() if key != "process"}
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.port}"
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def cdp(self, method, params=None):
+        """Send a DevTools command to the browser itself rather than to one of its pages."""
+        # Commands are rare, a socket opened per command is never shared by two workers
+        connection = websocket.create_connection(self._websocket_url, timeout=10)
+        try:
+            connection.send(json.dumps({"id": 1, "method": method, "params": params or {}}))
+            while True:
+                response = json.loads(connection.recv())
+                if response.get("id") == 1:
+                    break
+        finally:
+            connection.close()
+        if "error" in response:
+            raise RuntimeError(f"{method} failed: {response['error']}")
+        return response["result"]
+
+    def new_context(self):
+        """
+        Returns:
+            tuple: id of a new browser context and id of its first page, usable as window handle
+        """
+        context_id = self.cdp("Target.createBrowserContext", {"disposeOnDetach": False})[
+            "browserContextId"
+        ]
+        target_id = self.cdp(
+            "Target.createTarget", {"url": "about:blank", "browserContextId": context_id}
+        )["targetId"]
+        return context_id, target_id
+
+    def close_context(self, context_id):
+        self.cdp("Target.disposeBrowserContext", {"browserContextId": context_id})
+
+    def memory_usage(self):
+        """
+        Returns:
+            dict: rss and uss in bytes of the whole browser, and its number of contexts
+        """
+        usages = [memory_usage(pid) for pid in process_tree(self.pid)]
+        return {
+            "rss": sum(usage.get("rss", 0) for usage in usages),
+            "uss": sum(usage.get("uss", 0) for usage in usages),
+            "contexts": len(self.cdp("Target.getBrowserContexts")["browserContextIds"]),
+        }
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+class ContextBookingService(BookingService):
+    """
+    BookingService driving a browser context of a SharedBrowser instead of a Chrome of its own.
+    """
+
+    # Set by the scheduler before workers are forked
+    browser = None
+
+    def _setup_driver(self):
+        self._user_data_dir = None
+        self._context_id, target_id = self.browser.new_context()
+        chrome_options = Options()
+        chrome_options.debugger_address = self.browser.address
+        try:
+            self._start_driver(chrome_options, window=target_id)
+        except Exception:
+            # logout is never called on a service that failed to start
+            self.browser.close_context(self._context_id)
+            raise
+
+    def context_memory(self):
+        """JS heap used by the page of this context, in bytes."""
+        self.driver.execute_cdp_cmd("Performance.enable", {})
+        metrics = self.driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]
+        return next((m["value"] for m in metrics if m["name"] == "JSHeapUsedSize"), 0)
+
+    def logout(self):
+        try:
+            browser_usage = self.browser.memory_usage()
+            logger.info(
+                f"Context memory: js heap={self.context_memory() / 2**20:.0f} MB, "
+                f"browser rss={browser_usage['rss'] // 2**20} MB "
+                f"uss={browser_usage['uss'] // 2**20} MB for {browser_usage['contexts']} contexts"
+            )
+        except Exception as e:
+            logger.warning(f"Could not read context memory: {str(e)}")
+        try:
+            # Sessions attached to a browser only detach from it when quitting
+            super().logout()
+        finally:
+            self.browser.close_context(self._context_id)
@@ -0,0 +1,64 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+class CatalogDiff(NamedTuple):
+    """Keys of the rows that differ between two versions of a catalog."""
+
+    added: pd.Index
+    changed: pd.Index
+    removed: pd.Index
+
+    @property
+    def is_empty(self):
+        return not (len(self.added) or len(self.changed) or len(self.removed))
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+
+def keyed(data, key):
+    """Index data by the string value of its key column, keeping the key column itself."""
+    return data.set_index(data[key].astype(str).rename(None))
+
+
+def diff_catalog(previous, current, key):
+    """
+    Compare two versions of a catalog row by row.
+
+    Args:
+        previous (pd.DataFrame): catalog as it was last written
+        current (pd.DataFrame): freshly scraped catalog, with the same columns as previous
+        key (str): column uniquely identifying a row
+
+    Returns:
+        CatalogDiff: keys of the added, changed and removed rows, in the order of their frame
+    """
+    previous = keyed(previous.fillna("").astype(str), key)
+    current = keyed(current.fillna("").astype(str), key)
+    common = current.index.intersection(previous.index, sort=False)
+    is_changed = (current.loc[common] != previous.loc[common, current.columns]).any(axis=1)
+    return CatalogDiff(
+        added=current.index.difference(previous.index, sort=False),
+        changed=common[is_changed.to_numpy()],
+        removed=previous.index.difference(current.index, sort=False),
+    )
+
+
+def contiguous_runs(positions):
+    """
+    Group sorted integer positions into (first, last) runs of consecutive values.
+
+    Args:
+        positions (array-like): sorted row positions
+
+    Returns:
+        list: (first, last) tuples, bounds included
+    """
+    positions = np.asarray(positions)
+    if not len(positions):
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    return [(int(run[0]), int(run[-1])) for run in np.split(positions, breaks)]
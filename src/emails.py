@@ -1,14 +1,24 @@
 import os
 import smtplib
+from contextlib import suppress
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+from src.throttle import throttled
+
 
 class EmailService:
     def __init__(self):
         self.contact_address = os.environ["CONTACT"]
         self.contact_password = os.environ["PASSWORD"]
 
+    @throttled("smtp")
+    def _connect(self):
+        session = smtplib.SMTP("mail.gandi.net", 587)
+        session.starttls()
+        session.login(self.contact_address, self.contact_password)
+        return session
+
     def send_mail(self, data):
         message = MIMEMultipart("alternative")
         message["From"] = self.contact_address
@@ -17,10 +27,13 @@ class EmailService:
         message["Cc"] = data.get("Cc")
         message.attach(MIMEText(data.get("message"), "plain"))
         message.attach(MIMEText(data.get("message"), "html"))
-        session = smtplib.SMTP("mail.gandi.net", 587)
-        session.starttls()
-        session.login(self.contact_address, self.contact_password)
+        # Only the connection is retried: a lost response to sendmail would send the email twice
+        session = self._connect()
         text = message.as_string()
         recipients = [data["email"]] + ([data["Cc"]] if data.get("Cc") else [])
-        session.sendmail(self.contact_address, recipients, text)
-        session.quit()
+        try:
+            session.sendmail(self.contact_address, recipients, text)
+        finally:
+            # The email is sent whether or not the server acknowledges the end of the session
+            with suppress(OSError):
+                session.quit()
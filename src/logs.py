@@ -0,0 +1,96 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import multiprocessing as mp
+import os
+import random
+import uuid
+from contextlib import contextmanager
+
+# "text" or "json", one object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Share of the attempts whose DEBUG records are kept when LOG_LEVEL is DEBUG
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(module)s - %(funcName)s [%(attempt_id)s]: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+attempt_id = contextvars.ContextVar("attempt_id", default="-")
+_traced = contextvars.ContextVar("traced", default=False)
+_queue = None
+
+
+@contextmanager
+def correlated(_id=None):
+    """
+    Tag the records logged in the block with an attempt id, a new random one by default.
+
+    Whether the DEBUG records of the attempt are kept is drawn once for a new id, and inherited
+    by the ids given explicitly, e.g. for the sub attempts of a request.
+    """
+    id_token = attempt_id.set(_id or uuid.uuid4().hex[:8])
+    traced_token = _traced.set(_traced.get() if _id else random.random() < TRACE_SAMPLE_RATE)
+    try:
+        yield attempt_id.get()
+    finally:
+        attempt_id.reset(id_token)
+        _traced.reset(traced_token)
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record):
+        record.attempt_id = attempt_id.get()
+        return record.levelno > logging.DEBUG or _traced.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "attempt_id": getattr(record, "attempt_id", "-"),
+            "message": record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def attach(queue):
+    """Replace the root handlers by a single one putting the records, tagged, on queue."""
+    global _queue
+    _queue = queue
+    handler = logging.handlers.QueueHandler(queue)
+    handler.addFilter(CorrelationFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+def setup_logging():
+    """
+    Route the records of this process and of the workers it forks through a queue to a single
+    listener thread, so that logging never blocks on the output and lines do not interleave.
+
+    Returns:
+        mp.Queue: the queue to attach to in processes that are not forked from this one
+    """
+    if _queue is not None:
+        return _queue
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    )
+    queue = mp.Queue(-1)
+    listener = logging.handlers.QueueListener(queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    attach(queue)
+    logging.getLogger("apscheduler").setLevel(logging.ERROR)
+    return queue
+
+
+def log_queue():
+    return _queue
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from src.utils import state_path
+
+# Outcomes of an attempt on a slot. "error" is recorded too but, like "already_booked" and
+# "no_court", says nothing about how often the slot is won
+RACE_RESULTS = ["booked", "lost"]
+# Weight, in attempts, of the overall success rate in the rate of each slot
+PRIOR_ATTEMPTS = float(os.getenv("OUTCOME_PRIOR_ATTEMPTS", 2))
+WINDOW_DAYS = float(os.getenv("OUTCOME_WINDOW_DAYS", 90))
+
+
+def overall_rate(slots):
+    return slots.successes.sum() / max(slots.attempts.sum(), 1)
+
+
+class OutcomeStore:
+    """
+    Append-only log of booking attempts, used to rank slots by how often we win them.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): database file, defaults to outcomes.sqlite3 in the state directory
+        """
+        self.path = path or state_path("outcomes.sqlite3")
+        with closing(self._connect()) as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS attempts (
+                    attempted_at REAL NOT NULL,
+                    username TEXT,
+                    place TEXT,
+                    court TEXT,
+                    match_day TEXT,
+                    hour INTEGER,
+                    latency REAL,
+                    result TEXT NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def record(self, result, latency, username=None, place=None, hour=None, **details):
+        """
+        Args:
+            result (str): one of RACE_RESULTS, "error", "already_booked" or "no_court"
+            latency (float): seconds from the start of the attempt to its outcome
+            username (str): user the attempt was made for
+            place (str): canonical name of the place
+            hour (int): hour of the slot
+            details: court and match_day, when known
+        """
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    username,
+                    place,
+                    None if details.get("court") is None else str(details["court"]),
+                    details.get("match_day"),
+                    hour,
+                    latency,
+                    result,
+                ),
+            )
+
+    def success_rates(self):
+        """
+        Smoothed success rate of each (place, hour) slot raced over the last WINDOW_DAYS.
+
+        Returns:
+            pd.DataFrame: attempts, successes and rate, indexed by (place, hour)
+        """
+        with closing(self._connect()) as connection:
+            slots = pd.read_sql_query(
+                f"""
+                SELECT place, hour, COUNT(*) AS attempts, SUM(result = 'booked') AS successes
+                FROM attempts
+                WHERE attempted_at >= ? AND result IN ({", ".join("?" * len(RACE_RESULTS))})
+                GROUP BY place, hour
+                """,
+                connection,
+                params=[time.time() - WINDOW_DAYS * 86400, *RACE_RESULTS],
+            ).set_index(["place", "hour"])
+        prior = overall_rate(slots)
+        return slots.assign(
+            rate=lambda df: (df.successes + PRIOR_ATTEMPTS * prior) / (df.attempts + PRIOR_ATTEMPTS)
+        )
+
+    def rank(self, slots):
+        """
+        Sort (place, hour) slots by decreasing success rate. Slots never raced get the overall
+        rate, and ties keep their original order.
+        """
+        if len(slots) < 2:
+            return list(slots)
+        rates = self.success_rates()
+        rate = (
+            rates.rate.reindex(pd.MultiIndex.from_tuples(slots))
+            .fillna(overall_rate(rates))
+            .to_numpy()
+        )
+        return [slots[i] for i in sorted(range(len(slots)), key=lambda i: -rate[i])]
@@ -0,0 +1,52 @@
+import unicodedata
+
+
+def normalise(name):
+    """Case, accent, space and punctuation insensitive key of a place name."""
+    decomposed = unicodedata.normalize("NFKD", str(name))
+    return "".join(char for char in decomposed if char.isalnum()).lower()
+
+
+class PlaceIndex:
+    """
+    Constant time lookup of tennis places by canonical name, normalised name, id or search token.
+
+    The search form posts place names as its `where` token values, and result panels are
+    identified by the name without spaces: all of them resolve through the normalised key.
+    """
+
+    def __init__(self, names, ids=None):
+        """
+        Args:
+            names (list): canonical place names
+            ids (list): ids of the places, in the same order as names
+        """
+        self._names = {}
+        self._ids = {}
+        for name, _id in zip(names, ids if ids is not None else [None] * len(names)):
+            self._names[normalise(name)] = name
+            if _id is not None and _id != "":
+                self._names[str(_id)] = name
+                self._ids[name] = _id
+
+    @classmethod
+    def from_catalog(cls, tennis):
+        """
+        Args:
+            tennis (pd.DataFrame): content of the Tennis sheet
+        """
+        return cls(tennis.nomSrtm.to_list(), tennis.id.to_list())
+
+    def __contains__(self, key):
+        return self.resolve(key) is not None
+
+    def resolve(self, key):
+        """Return the canonical name of the place designated by key, or None if unknown."""
+        return self._names.get(str(key)) or self._names.get(normalise(key))
+
+    def id(self, key):
+        return self._ids.get(self.resolve(key))
+
+    def token(self, key):
+        """Return the value the search form expects for the place designated by key."""
+        return self.resolve(key)
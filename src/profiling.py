@@ -0,0 +1,83 @@
+import cProfile
+import functools
+import glob
+import logging
+import os
+import signal
+from datetime import datetime
+
+from src.utils import state_path
+
+PROFILE_DIR = os.getenv("PROFILE_DIR") or state_path("profiles")
+# Number of profiles kept per profiled function, the oldest ones are deleted first
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 20))
+logger = logging.getLogger(__name__)
+
+_enabled = os.getenv("RAINBOT_PROFILE", "false").lower() == "true"
+_profiler = None
+
+
+def toggle(*_):
+    """Switch profiling on or off, used as SIGUSR1 handler. Forked workers inherit the state."""
+    global _enabled
+    _enabled = not _enabled
+    logger.log(logging.INFO, f"Profiling {'enabled' if _enabled else 'disabled'}")
+
+
+def _reset_in_child():
+    """Stop the profile of the parent in forked workers, so that they profile their own calls."""
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def install_signal_handler():
+    signal.signal(signal.SIGUSR1, toggle)
+
+
+def prune(name):
+    # File names start with the timestamp of the call, so they sort chronologically
+    profiles = sorted(glob.glob(os.path.join(PROFILE_DIR, f"{name}-*.pstats")))
+    for path in profiles[: max(len(profiles) - PROFILE_KEEP, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already pruned by another worker
+            pass
+
+
+def profiled(func):
+    """
+    Profile each call of func with cProfile while profiling is enabled.
+
+    One pstats file is written per call and per process in PROFILE_DIR, to be read with pstats,
+    snakeviz or turned into a flame graph with flameprof. Calls made while another profiled
+    call is running in the same process are part of the outer profile.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _profiler
+        if not _enabled or _profiler is not None:
+            return func(*args, **kwargs)
+        profiler = _profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _profiler = None
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(
+                os.path.join(
+                    PROFILE_DIR,
+                    f"{func.__name__}-{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}.pstats",
+                )
+            )
+            prune(func.__name__)
+
+    return wrapper
@@ -1,13 +1,16 @@
 # type: ignore
+import atexit
+import contextvars
+import gc
 import json
 import logging
 import multiprocessing as mp
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from itertools import chain
 
-mp.set_start_method("fork")
-
 import numpy as np
 import pandas as pd
 import requests
@@ -15,10 +18,28 @@ from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from inflection import camelize, underscore
 
+from src.availability import AvailabilityCache, query_key
 from src.booking_service import BookingService
+from src.browser_pool import ContextBookingService, SharedBrowser
 from src.emails import EmailService
+from src.logs import attach, attempt_id, correlated, log_queue
+from src.outcomes import RACE_RESULTS, OutcomeStore
+from src.places import PlaceIndex
+from src.profiling import profiled
+from src.spatial_index import SpatialIndex
+from src.speculative import Race
 from src.spreadsheet import DriveClient
-from src.utils import date_of_next_day
+from src.status import (
+    attach_events,
+    event_queue,
+    pool_running,
+    report_done,
+    report_phase,
+    tracked,
+)
+from src.throttle import UpstreamUnavailable
+from src.utils import date_of_next_day, memory_usage, state_path
+from src.work_queue import SQLiteWorkQueue
 
 load_dotenv()
 DAYS_OF_WEEK = dict(zip(["mon", "tue", "wed", "thu", "fri", "sat", "sun"], range(7)))
@@ -31,45 +52,195 @@ DAYS_FRENCH_TO_ENGLISH = {
     "samedi": "sat",
     "dimanche": "sun",
 }
+DEFAULT_RADIUS_KM = float(os.getenv("DEFAULT_RADIUS_KM", 2))
+# "local" books in a pool forked from the scheduler, "queue" hands requests to src.schedulers.worker
+# processes sharing the file system of WORK_QUEUE_PATH
+BOOKING_MODE = os.getenv("BOOKING_MODE", "local")
+# "fork" shares the scheduler memory copy-on-write, "forkserver" forks workers from a server
+# that only preloaded this module
+START_METHOD = os.getenv("MP_START_METHOD", "fork")
+# "chrome" starts a Chrome per booking, "contexts" books in browser contexts of a shared Chrome
+BROWSER_BACKEND = os.getenv("BROWSER_BACKEND", "chrome")
+# Number of slots raced in parallel for the requests with priority
+SPECULATIVE_ATTEMPTS = int(os.getenv("SPECULATIVE_ATTEMPTS", 3))
 logger = logging.getLogger(__name__)
 email_service = EmailService()
 drive_client = DriveClient()
-booking_service = BookingService()
+work_queue = SQLiteWorkQueue(os.getenv("WORK_QUEUE_PATH"))
+outcome_store = OutcomeStore(os.getenv("OUTCOMES_PATH"))
+availability_cache = AvailabilityCache(os.getenv("AVAILABILITY_CACHE_PATH"))
+mp_context = mp.get_context(START_METHOD)
+if START_METHOD == "forkserver":
+    mp_context.set_forkserver_preload([__name__])
 
 
-def book(row):
-    message = f"Booking for {row['username']} playing on {row['match_day']}"
-    logger.log(logging.INFO, message)
-    place, time = booking_service.find_courts_without_login(**row)
-    if not place:
-        message = f"No court available for {row['username']} playing on {row['match_day']}"
-        logger.log(logging.INFO, message)
-        return
+def init_worker(place_index, queue, browser, events):
+    # Passed explicitly since forkserver workers do not inherit the scheduler state
+    BookingService.place_index = place_index
+    ContextBookingService.browser = browser
+    if queue is not None:
+        attach(queue)
+    if events is not None:
+        attach_events(events)
+
+
+def get_shared_browser():
+    """Return the shared browser of the contexts backend, started or restarted on demand."""
+    if BROWSER_BACKEND != "contexts":
+        return None
+    if ContextBookingService.browser is None or not ContextBookingService.browser.alive:
+        ContextBookingService.browser = SharedBrowser()
+        atexit.register(ContextBookingService.browser.close)
+    return ContextBookingService.browser
+
+
+def new_booking_service():
+    if BROWSER_BACKEND == "contexts":
+        return ContextBookingService()
+    return BookingService()
+
+
+def attempt(row, place, hour, race=None):
+    """Book the (place, hour) slot for the request in row with a browser of its own."""
+    started = time.monotonic()
+    result = "error"
+    booking_service = None
     try:
+        report_phase("starting_browser")
         logger.log(logging.INFO, f"Found court for {row['username']}, booking it")
-        booking_service.book_court(
-            place=place, **{**row, "hour_from": f"{time:02d}", "hour_to": f"{time + 1:02d}"}
-        )
-        drive_client.append_series_to_sheet(
-            sheet_title="Historique",
-            data=(
-                pd.Series(
-                    {
-                        **row,
-                        "request_id": row["row_id"],
-                        **booking_service.reservation,
-                    }
-                ).rename(underscore)
-            ),
+        # The browser session is only started in the worker, once there is a court to book
+        booking_service = new_booking_service()
+        result = booking_service.book_court(
+            place=place,
+            **{**row, "hour_from": f"{hour:02d}", "hour_to": f"{hour + 1:02d}"},
+            race=race,
         )
+        if result == "booked":
+            drive_client.append_series_to_sheet(
+                sheet_title="Historique",
+                data=(
+                    pd.Series(
+                        {
+                            **row,
+                            "request_id": row["row_id"],
+                            **booking_service.reservation,
+                        }
+                    ).rename(underscore)
+                ),
+            )
     except Exception as e:
         info = pd.Series(row.copy()).astype(str).to_dict()
         del info["password"]
         logger.log(logging.ERROR, f"Raising error for\n{json.dumps(info, indent=4)}:\n {e}")
     finally:
-        booking_service.logout()
+        if booking_service is not None:
+            booking_service.logout()
+        latency = time.monotonic() - started
+        report_done(result, latency)
+        if result in [*RACE_RESULTS, "error"]:
+            # The slot was taken, by us or by someone else, or may have been
+            availability_cache.invalidate(query_key(**row))
+        outcome_store.record(
+            result,
+            latency,
+            row["username"],
+            place,
+            hour,
+            court=booking_service.reservation.get("courtId") if booking_service else None,
+            match_day=row["match_day"],
+        )
+    return result
+
+
+def find_slots(row):
+    """Available slots for the request in row, searched once for all the workers of the host."""
+    key = query_key(**row)
+    slots = availability_cache.get(key)
+    if slots is not None:
+        logger.log(logging.DEBUG, f"Slots of {key} served from cache")
+        return slots
+    slots = BookingService.find_all_courts_without_login(**row)
+    availability_cache.put(key, slots)
+    return slots
+
+
+@profiled
+@correlated()
+@tracked("searching")
+def book(row):
+    message = f"Booking for {row['username']} playing on {row['match_day']}"
+    logger.log(logging.INFO, message)
+    started = time.monotonic()
+    try:
+        slots = find_slots(row)
+    except UpstreamUnavailable as e:
+        logger.log(logging.WARNING, f"Skipping {row['username']}: {e}")
+        return
+    if not slots:
+        message = f"No court available for {row['username']} playing on {row['match_day']}"
+        logger.log(logging.INFO, message)
+        outcome_store.record(
+            "no_court", time.monotonic() - started, row["username"], match_day=row["match_day"]
+        )
+        return
+    # Race for the slots we most often win
+    slots = outcome_store.rank(slots)
+    if str(row.get("priority")).upper() == "TRUE" and SPECULATIVE_ATTEMPTS > 1:
+        slots = slots[:SPECULATIVE_ATTEMPTS]
+        logger.log(logging.INFO, f"Racing {len(slots)} slots for {row['username']}")
+        race = Race()
+        report_phase("racing")
+        context = contextvars.copy_context()
+
+        def race_slot(i, slot):
+            with correlated(f"{attempt_id.get()}.{i}"):
+                return attempt(row, *slot, race=race)
+
+        # Threads since pool workers cannot fork, each attempt drives its own browser
+        with ThreadPoolExecutor(max_workers=len(slots)) as executor:
+            list(
+                executor.map(
+                    lambda i_slot: context.copy().run(race_slot, *i_slot), enumerate(slots)
+                )
+            )
+    else:
+        attempt(row, *slots[0])
+    usage = memory_usage()
+    if usage:
+        logger.log(
+            logging.INFO,
+            f"Worker {os.getpid()} memory: rss={usage['rss'] // 2**20} MB, "
+            f"uss={usage['uss'] // 2**20} MB",
+        )
 
 
+def add_nearby_places(requests, spatial_index):
+    """
+    Complete the places of the requests having a `near` column with the places within
+    `radius_km` of it, closest first, all requests being resolved in a single batch.
+    """
+    if "near" not in requests:
+        return requests.places
+    nearby = requests.near.astype(str).str.strip() != ""
+    radius_km = pd.to_numeric(
+        requests.get("radius_km", pd.Series(index=requests.index, dtype=float)), errors="coerce"
+    ).fillna(DEFAULT_RADIUS_KM)
+    ranked = pd.Series(
+        spatial_index.nearest(requests.near[nearby], radius_km[nearby]),
+        index=requests.index[nearby],
+        dtype=object,
+    ).reindex(requests.index)
+    return [
+        (
+            places + [p for p in nearby_places if p not in places]
+            if isinstance(nearby_places, list)
+            else places
+        )
+        for places, nearby_places in zip(requests.places, ranked)
+    ]
+
+
+@profiled
 def booking_job():
     users = (
         drive_client.users.rename(columns=underscore)
@@ -77,12 +248,10 @@ def booking_job():
         .loc[lambda df: df.password != ""]
         .loc[lambda df: df["payé/montant"] != ""][["username", "password"]]
     )
-    places = (
-        drive_client.get_sheet_as_dataframe("Tennis")
-        .rename(columns={"nomSrtm": "name"})
-        .set_index("name")
-        .id
-    )
+    tennis = drive_client.get_sheet_as_dataframe("Tennis")
+    place_index = PlaceIndex.from_catalog(tennis)
+    spatial_index = SpatialIndex.from_catalog(tennis)
+    BookingService.place_index = place_index
     booking_references = (
         drive_client.get_sheet_as_dataframe("Requests")
         .rename(columns=underscore)
@@ -93,7 +262,12 @@ def booking_job():
             places=lambda df: df.filter(regex=r"court_\d").agg(
                 lambda r: r[r != ""].to_list(), axis=1
             ),
-            places_id=lambda df: df.places.map(lambda _places: [places.get(_p) for _p in _places]),
+        )
+        .assign(
+            places=lambda df: add_nearby_places(df, spatial_index),
+            places_id=lambda df: df.places.map(
+                lambda _places: [place_index.id(_p) for _p in _places]
+            ),
             in_out=lambda df: df.in_out.str.split(","),
         )
         .replace({"": np.NaN})
@@ -123,26 +297,88 @@ def booking_job():
         .set_index("row_id")
         .sort_values("match_date", ascending=False)
     )
-    with mp.Pool(processes=len(booking_references)) as pool:
-        pool.map(book, booking_references.reset_index().to_dict("records"))
+    if booking_references.empty:
+        return
+    records = booking_references.reset_index().to_dict("records")
+    if BOOKING_MODE == "queue":
+        for record in records:
+            work_queue.put(
+                item_id=str(record["row_id"]),
+                shard_key=record["username"],
+                payload=json.dumps(record, default=str),
+            )
+        return
+    # Forked workers inherit the token, renewing it here spares each of them a token request
+    drive_client.refresh_token()
+    # Move the objects of the scheduler out of the collected generations so that the garbage
+    # collector of the workers does not write to, and thus copy, the pages shared with it
+    gc.collect()
+    gc.freeze()
+    try:
+        with pool_running(len(records)):
+            pool = mp_context.Pool(
+                processes=len(records),
+                initializer=init_worker,
+                initargs=(place_index, log_queue(), get_shared_browser(), event_queue()),
+            )
+            try:
+                pool.map(book, records)
+            finally:
+                # Not terminate(), as exiting the pool with "with" does: a worker killed while
+                # writing to the log or status queue loses its last records and can leave the
+                # lock of the queue held
+                pool.close()
+                pool.join()
+    finally:
+        gc.unfreeze()
+
+
+@profiled
+def upcoming_bookings():
+    """
+    Bookings not yet started, kept in the state directory and updated with the rows appended to
+    Historique since the previous call, so that the whole sheet is not read at each run.
+
+    Returns:
+        pd.DataFrame: upcoming bookings sorted by date_deb
+    """
+    path = state_path("upcoming_bookings.pkl")
+    try:
+        bookings = pd.read_pickle(path)
+    except FileNotFoundError:
+        bookings = pd.DataFrame()
+        # Read the sheet from the start, the rows before the watermark were in the lost file
+        drive_client.commit_watermark("Historique", 1)
+    new_rows, watermark = drive_client.read_new_rows(
+        "Historique", ["date_deb", "username", "court_id", "equipment_id", "partenaire/id"]
+    )
+    new_bookings = (
+        new_rows.loc[lambda df: df.date_deb != ""]
+        .assign(date_deb=lambda df: pd.to_datetime(df.date_deb, utc=True, errors="coerce"))
+        .dropna(subset=["date_deb"])
+    )
+    bookings = (
+        pd.concat([bookings, new_bookings], ignore_index=True)
+        .loc[lambda df: df.date_deb >= pd.Timestamp.today(tz="utc")]
+        .sort_values("date_deb", kind="stable")
+        .reset_index(drop=True)
+    )
+    bookings.to_pickle(path)
+    drive_client.commit_watermark("Historique", watermark)
+    return bookings
 
 
 def send_remainder():
     courts = drive_client.get_sheet_as_dataframe("Courts").set_index("_airId")["_airNom"]
     tennis = drive_client.get_sheet_as_dataframe("Tennis").set_index("id")["nomSrtm"]
     ongoing_bookings = (
-        drive_client.get_sheet_as_dataframe("Historique")
-        .rename(columns=underscore)
-        .loc[lambda df: df.date_deb != ""]
+        upcoming_bookings()
+        .loc[lambda df: df.date_deb < pd.Timestamp.today(tz="utc") + pd.Timedelta(days=1)]
         .assign(
-            date_deb=lambda df: pd.to_datetime(df.date_deb, utc=True),
             heure_deb=lambda df: df.date_deb.dt.hour,
             court=lambda df: df.court_id.replace(courts),
             equipment=lambda df: df.equipment_id.replace(tennis),
         )
-        .dropna(subset=["date_deb"])
-        .loc[lambda df: df.date_deb >= pd.Timestamp.today(tz="utc")]
-        .loc[lambda df: df.date_deb < pd.Timestamp.today(tz="utc") + pd.Timedelta(days=1)]
     )
     message = """
     Aujourd'hui c'est jour de match !
@@ -191,7 +427,7 @@ def update_data():
         ]
     ]
 
-    drive_client.set_sheet_from_dataframe(
+    diff = drive_client.sync_sheet_from_dataframe(
         "Tennis",
         (
             pd.DataFrame([t["general"] for t in tennis])
@@ -200,9 +436,11 @@ def update_data():
             .drop_duplicates(subset=["nomSrtm"])
             .assign(gps=lambda df: df.gpsLat.astype(str) + "," + df.gpsLon.astype(str))
         ),
+        key="id",
     )
+    logger.log(logging.INFO, f"Tennis synced: {diff}")
 
-    drive_client.set_sheet_from_dataframe(
+    diff = drive_client.sync_sheet_from_dataframe(
         "Courts",
         (
             pd.DataFrame(
@@ -226,4 +464,6 @@ def update_data():
             .filter(items=["_airId", "_airNom", "id", "surface", "eclaire", "ouvert", "couvert"])
             .drop_duplicates(subset=["_airId"])
         ),
+        key="_airId",
     )
+    logger.log(logging.INFO, f"Courts synced: {diff}")
@@ -0,0 +1,64 @@
+# type: ignore
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.logs import setup_logging
+from src.profiling import install_signal_handler
+from src.schedulers.cron_jobs import book, get_shared_browser, work_queue
+from src.work_queue import heartbeat_interval
+
+LEASE_TTL = int(os.getenv("LEASE_TTL", 120))
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 0.5))
+logger = logging.getLogger(__name__)
+
+
+def keep_alive(lease, stop):
+    """Heartbeat lease, which also registers the worker, until stop is set."""
+    while not stop.wait(heartbeat_interval(LEASE_TTL, work_queue.worker_ttl)):
+        if not work_queue.heartbeat(lease, LEASE_TTL):
+            logger.log(logging.WARNING, f"Lease on {lease.item_id} lost to another worker")
+            return
+
+
+def run_worker(worker_id=None):
+    """
+    Pull booking requests from the shared work queue and book them, one at a time.
+
+    The queue is a SQLite file: workers must run on the host of the scheduler, or share the
+    file system holding WORK_QUEUE_PATH with it.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    logger.log(logging.INFO, f"Worker {worker_id} started")
+    while True:
+        work_queue.register(worker_id)
+        lease = work_queue.lease(worker_id, LEASE_TTL)
+        if lease is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_alive, args=(lease, stop), daemon=True)
+        heartbeat.start()
+        try:
+            get_shared_browser()
+            book(json.loads(lease.payload))
+        except Exception:
+            # The request is retried when the scheduler enqueues it again at its next tick
+            logger.exception(f"Booking {lease.item_id} failed")
+        finally:
+            stop.set()
+            heartbeat.join()
+            work_queue.complete(lease)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    install_signal_handler()
+    run_worker()
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from src.places import PlaceIndex
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class SpatialIndex:
+    """
+    Distance lookups between arbitrary points and the tennis centres of the catalog.
+
+    The catalog only holds a few dozen centres, so distances are computed for a whole batch of
+    queries against every centre at once with numpy rather than through a tree.
+    """
+
+    def __init__(self, names, lat, lon):
+        """
+        Args:
+            names (list): canonical place names
+            lat (list): latitudes of the places, in degrees
+            lon (list): longitudes of the places, in degrees
+        """
+        self.names = np.asarray(names, dtype=object)
+        self._lat = np.radians(np.asarray(lat, dtype=float))
+        self._lon = np.radians(np.asarray(lon, dtype=float))
+        self._place_index = PlaceIndex(list(self.names))
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_catalog(cls, tennis):
+        """
+        Args:
+            tennis (pd.DataFrame): content of the Tennis sheet
+        """
+        located = tennis.assign(
+            gpsLat=lambda df: pd.to_numeric(df.gpsLat, errors="coerce"),
+            gpsLon=lambda df: pd.to_numeric(df.gpsLon, errors="coerce"),
+        ).dropna(subset=["gpsLat", "gpsLon"])
+        return cls(located.nomSrtm.to_list(), located.gpsLat, located.gpsLon)
+
+    def locate(self, near):
+        """Return the (lat, lon) in degrees of a place name or of a "lat,lon" string."""
+        name = self._place_index.resolve(near)
+        if name is not None:
+            position = self._positions[name]
+            return np.degrees(self._lat[position]), np.degrees(self._lon[position])
+        try:
+            lat, lon = map(float, str(near).split(","))
+        except ValueError:
+            return np.nan, np.nan
+        return lat, lon
+
+    def distances(self, lat, lon):
+        """
+        Great-circle distances between points and every place of the index.
+
+        Args:
+            lat (array-like): latitudes of the points, in degrees
+            lon (array-like): longitudes of the points, in degrees
+
+        Returns:
+            np.ndarray: (n_points, n_places) distances in km, NaN for unknown points
+        """
+        lat = np.radians(np.asarray(lat, dtype=float))[:, None]
+        lon = np.radians(np.asarray(lon, dtype=float))[:, None]
+        haversine = (
+            np.sin((self._lat - lat) / 2) ** 2
+            + np.cos(lat) * np.cos(self._lat) * np.sin((self._lon - lon) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(haversine))
+
+    def nearest(self, near, radius_km):
+        """
+        Rank the places within radius_km of each query point, closest first.
+
+        Args:
+            near (list-like): place names or "lat,lon" strings
+            radius_km (list-like): search radius of each query
+
+        Returns:
+            list: one list of place names per query, empty when near cannot be located
+        """
+        points = np.array([self.locate(n) for n in near], dtype=float).reshape(-1, 2)
+        distances = self.distances(points[:, 0], points[:, 1])
+        order = np.argsort(distances, axis=1)
+        ranked = np.take_along_axis(distances, order, axis=1)
+        within = ranked <= np.asarray(radius_km, dtype=float)[:, None]
+        return [self.names[o[w]].tolist() for o, w in zip(order, within)]
@@ -0,0 +1,24 @@
+import threading
+
+
+class Race:
+    """
+    Coordination of the parallel attempts made for a single request.
+
+    The first attempt to reach the payment claims the race, the others give up at their next
+    checkpoint so that at most one booking goes through.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._winner = None
+
+    def claim(self, attempt):
+        """Return True if attempt is the first one to claim the race, or already won it."""
+        with self._lock:
+            if self._winner is None:
+                self._winner = attempt
+            return self._winner is attempt
+
+    def is_lost(self, attempt):
+        return self._winner is not None and self._winner is not attempt
@@ -1,11 +1,28 @@
 import json
+import logging
 import os
+import time
+from datetime import datetime, timedelta
 
 import gspread
 import pandas as pd
+import requests
+from gspread.utils import absolute_range_name, numericise_all, rowcol_to_a1
 from inflection import underscore
 from oauth2client.service_account import ServiceAccountCredentials
 
+from src.catalog import CatalogDiff, contiguous_runs, diff_catalog, keyed
+from src.throttle import throttle, throttled
+from src.utils import state_path
+
+# Quota (429) and server errors of the Sheets API surface as APIError
+SHEETS_ERRORS = (gspread.exceptions.APIError, requests.RequestException)
+# The access token is renewed when it expires in less than this many seconds
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 300))
+# Seconds after which the headers are read again to catch columns added or moved in the sheets
+HEADERS_TTL = int(os.getenv("HEADERS_TTL", 600))
+logger = logging.getLogger(__name__)
+
 
 class DriveClient:
     def __init__(self, client_secret="client_secret.json"):
@@ -15,36 +32,74 @@ class DriveClient:
         self._client = None
         self._worksheets = []
         self._headers = {}
+        self._watermarks_path = state_path("watermarks.json")
+        try:
+            with open(self._watermarks_path) as watermarks:
+                self._watermarks = json.load(watermarks)
+        except FileNotFoundError:
+            self._watermarks = {}
         self.login()
 
+    # Public methods are throttled, not the helpers they call, so that an error is counted once
+    @throttled("sheets", retry_on=SHEETS_ERRORS)
     def login(self):
         self._client = gspread.authorize(self.credentials)
-        self._worksheets = self._client.open("RainBot").worksheets()
+        self._spreadsheet = self._client.open("RainBot")
+        self._worksheets = self._spreadsheet.worksheets()
         self._users = self._client.open("RainBotUsers").worksheet("Users")
-        self._headers = {
-            worksheet.title: list(map(underscore, worksheet.get_all_values()[0]))
-            for worksheet in self._worksheets
+        self._load_headers()
+
+    def refresh_token(self):
+        """
+        Renew the access token in place when it is missing or about to expire, without reopening
+        the spreadsheets. Called before forking so that workers do not each renew it.
+        """
+        auth = self._client.auth
+        expiry = auth.expiry or datetime.min
+        if auth.token is None or expiry - datetime.utcnow() < timedelta(
+            seconds=TOKEN_REFRESH_MARGIN
+        ):
+            self._client.login()
+
+    def _load_headers(self):
+        """Read the first row of all the worksheets in a single request."""
+        value_ranges = self._spreadsheet.values_batch_get(
+            [absolute_range_name(worksheet.title, "1:1") for worksheet in self._worksheets]
+        )["valueRanges"]
+        headers = {
+            worksheet.title: list(map(underscore, value_range.get("values", [[]])[0]))
+            for worksheet, value_range in zip(self._worksheets, value_ranges)
         }
+        for title, header in headers.items():
+            if title in self._headers and self._headers[title] != header:
+                logger.log(logging.INFO, f"Columns of {title} changed to {header}")
+        self._headers = headers
+        self._headers_loaded_at = time.monotonic()
 
     @property
+    @throttled("sheets", retry_on=SHEETS_ERRORS)
     def users(self):
+        self.refresh_token()
         return pd.DataFrame(self._users.get_all_records())
 
     @property
     def worksheets(self):
-        if self._client.auth.expired:
-            self.login()
+        self.refresh_token()
         return {worksheet.title: worksheet for worksheet in self._worksheets}
 
     @property
     def headers(self):
-        if self._client.auth.expired:
-            self.login()
+        if time.monotonic() - self._headers_loaded_at > HEADERS_TTL:
+            self.refresh_token()
+            self._load_headers()
         return self._headers
 
+    @throttled("sheets", retry_on=SHEETS_ERRORS)
     def get_sheet_as_dataframe(self, sheet_title: str) -> pd.DataFrame:
         return pd.DataFrame(self.worksheets[sheet_title].get_all_records())
 
+    # Not retried: a lost response would append the row twice
+    @throttled("sheets", retries=0, retry_on=SHEETS_ERRORS)
     def append_series_to_sheet(self, sheet_title, data):
         self.worksheets[sheet_title].append_row(
             data.reindex(self.headers[sheet_title]).fillna("").to_list(),
@@ -52,11 +107,157 @@ class DriveClient:
             table_range="A1",
         )
 
+    @throttled("sheets", retry_on=SHEETS_ERRORS)
     def clear_sheet(self, sheet_title):
         self.worksheets[sheet_title].clear()
         self.worksheets[sheet_title].append_row(self.headers[sheet_title])
+        self.commit_watermark(sheet_title, 1)
+
+    def commit_watermark(self, sheet_title, row):
+        """Remember row as the last one read from sheet_title, once the rows up to it are saved."""
+        self._watermarks[sheet_title] = row
+        with open(self._watermarks_path, "w") as watermarks:
+            json.dump(self._watermarks, watermarks)
+
+    @throttled("sheets", retry_on=SHEETS_ERRORS)
+    def read_new_rows(self, sheet_title: str, columns: list) -> tuple:
+        """
+        Fetch the rows of an append-only sheet added since the last committed watermark, and only
+        the given columns of them. The watermark is not moved: pass the returned one to
+        commit_watermark once the rows are saved, so that they are read again if saving fails.
+
+        Args:
+            sheet_title (str): title of the worksheet
+            columns (list): underscored names of the columns to fetch
+
+        Returns:
+            tuple: new rows with the given columns, numbers converted as get_all_records does, and
+                the watermark to commit after them
+        """
+        # Row 1 holds the headers
+        first_row = self._watermarks.get(sheet_title, 1) + 1
+        if not set(columns) <= set(self.headers[sheet_title]):
+            # Columns renamed since the headers were last read
+            self._load_headers()
+        letters = [
+            rowcol_to_a1(1, self.headers[sheet_title].index(column) + 1)[:-1] for column in columns
+        ]
+        value_ranges = self.worksheets[sheet_title].batch_get(
+            [f"{letter}{first_row}:{letter}" for letter in letters]
+        )
+        # Trailing empty cells are not returned, pad all the columns to the same length
+        length = max(map(len, value_ranges), default=0)
+        new_rows = pd.DataFrame(
+            {
+                column: numericise_all(
+                    [row[0] if row else "" for row in values] + [""] * (length - len(values))
+                )
+                for column, values in zip(columns, value_ranges)
+            }
+        )
+        return new_rows, first_row - 1 + length
 
+    @throttled("sheets", retry_on=SHEETS_ERRORS)
     def set_sheet_from_dataframe(self, sheet_title: str, data: pd.DataFrame):
         self.worksheets[sheet_title].update(
             [data.columns.to_list(), *data.fillna("").values.tolist()]
         )
+
+    def sync_sheet_from_dataframe(self, sheet_title: str, data: pd.DataFrame, key: str):
+        """
+        Write only the rows of data that differ from the last synced version of the sheet.
+
+        The last synced catalog is kept in the local state directory so that the diff does not
+        require reading the sheet back. Without a snapshot the sheet itself is used as reference,
+        and a change of columns falls back to a full rewrite.
+
+        Args:
+            sheet_title (str): title of the worksheet
+            data (pd.DataFrame): full catalog to write
+            key (str): column uniquely identifying a row
+
+        Returns:
+            CatalogDiff: keys of the rows added, changed and removed in the sheet
+        """
+        data = data.drop_duplicates(subset=[key]).fillna("")
+        snapshot_path = state_path(f"{sheet_title}.pkl")
+        try:
+            previous = pd.read_pickle(snapshot_path)
+        except FileNotFoundError:
+            values = throttle.call(
+                "sheets", self.worksheets[sheet_title].get_all_values, retry_on=SHEETS_ERRORS
+            )
+            previous = pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame()
+        else:
+            # Until all the writes below went through, the snapshot may not match the sheet:
+            # dropping it makes the next run diff against the sheet itself if one fails
+            os.remove(snapshot_path)
+
+        if previous.columns.to_list() != data.columns.to_list():
+            self.set_sheet_from_dataframe(sheet_title, data)
+            data.to_pickle(snapshot_path)
+            return CatalogDiff(
+                added=pd.Index(data[key].astype(str)), changed=pd.Index([]), removed=pd.Index([])
+            )
+
+        diff = diff_catalog(previous, data, key)
+        worksheet = self.worksheets[sheet_title]
+        previous_keys = pd.Index(previous[key].astype(str))
+        current = keyed(data, key)
+
+        if len(diff.changed):
+            # Rows are 1-indexed and the first one holds the headers
+            rows = sorted(previous_keys.get_indexer(diff.changed) + 2)
+            throttle.call(
+                "sheets",
+                worksheet.batch_update,
+                [
+                    {
+                        "range": f"{rowcol_to_a1(first, 1)}:{rowcol_to_a1(last, len(data.columns))}",
+                        "values": current.loc[previous_keys[first - 2 : last - 1]].values.tolist(),
+                    }
+                    for first, last in contiguous_runs(rows)
+                ],
+                retry_on=SHEETS_ERRORS,
+            )
+        if len(diff.removed):
+            rows = sorted(previous_keys.get_indexer(diff.removed) + 2)
+            # Not retried, nor the append: a lost response would delete or append rows twice
+            throttle.call(
+                "sheets",
+                worksheet.spreadsheet.batch_update,
+                {
+                    "requests": [
+                        {
+                            "deleteDimension": {
+                                "range": {
+                                    "sheetId": worksheet.id,
+                                    "dimension": "ROWS",
+                                    "startIndex": first - 1,
+                                    "endIndex": last,
+                                }
+                            }
+                        }
+                        # Delete from the bottom so that remaining row numbers stay valid
+                        for first, last in reversed(contiguous_runs(rows))
+                    ]
+                },
+                retries=0,
+                retry_on=SHEETS_ERRORS,
+            )
+        if len(diff.added):
+            throttle.call(
+                "sheets",
+                worksheet.append_rows,
+                current.loc[diff.added].values.tolist(),
+                insert_data_option="INSERT_ROWS",
+                table_range="A1",
+                retries=0,
+                retry_on=SHEETS_ERRORS,
+            )
+
+        kept = previous_keys[~previous_keys.isin(diff.removed)]
+        pd.concat([current.loc[kept], current.loc[diff.added]]).reset_index(drop=True).to_pickle(
+            snapshot_path
+        )
+        return diff
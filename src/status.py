@@ -0,0 +1,296 @@
+import functools
+import json
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from src.logs import attempt_id
+
+STATUS_HOST = os.getenv("STATUS_HOST", "127.0.0.1")
+# Port of the status endpoint of the scheduler, 0 disables it
+STATUS_PORT = int(os.getenv("STATUS_PORT", 8321))
+# Number of recent attempts the latency percentiles are computed on
+LATENCY_WINDOW = int(os.getenv("STATUS_LATENCY_WINDOW", 200))
+QUANTILES = [0.5, 0.9, 0.99]
+# Phases reported before a browser is started for the attempt
+SEARCH_PHASES = ["searching", "racing"]
+logger = logging.getLogger(__name__)
+
+_events = None
+_board = None
+
+
+def report_phase(phase):
+    """Report the phase the current attempt entered, a no-op when no status server listens."""
+    if _events is not None:
+        _events.put(("phase", attempt_id.get(), os.getpid(), phase, time.time()))
+
+
+def report_done(result=None, latency=None):
+    """Report the end of the current attempt, with its result and latency for attempts on a slot."""
+    if _events is not None:
+        _events.put(("done", attempt_id.get(), os.getpid(), result, latency))
+
+
+def tracked(phase):
+    """Report the decorated function as an attempt starting in phase, until it returns."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            report_phase(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                report_done()
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def pool_running(size):
+    """Count the workers of a pool in the capacity of the scheduler while it runs."""
+    if _board is not None:
+        _board.add_workers(size)
+    try:
+        yield
+    finally:
+        if _board is not None:
+            _board.add_workers(-size)
+
+
+def event_queue():
+    return _events
+
+
+def attach_events(queue):
+    """Make report_phase and report_done post to queue, the event queue of the status server."""
+    global _events
+    _events = queue
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StatusBoard:
+    """
+    In-memory state of the attempts of the scheduler and its workers, updated from their events.
+    """
+
+    def __init__(self, scheduler=None, work_queue=None):
+        self.scheduler = scheduler
+        self.work_queue = work_queue
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._results = Counter()
+        self._latency_count = 0
+        self._latency_sum = 0.0
+        self._workers = 0
+
+    def add_workers(self, count):
+        with self._lock:
+            self._workers += count
+
+    def apply(self, event):
+        kind, _id, pid, *values = event
+        with self._lock:
+            if kind == "phase":
+                phase, at = values
+                entry = self._in_flight.setdefault(_id, {"pid": pid, "started": at})
+                entry.update(phase=phase, phase_started=at)
+            elif kind == "done":
+                result, latency = values
+                self._in_flight.pop(_id, None)
+                if result is not None:
+                    self._results[result] += 1
+                if latency is not None:
+                    self._latencies.append(latency)
+                    self._latency_count += 1
+                    self._latency_sum += latency
+
+    def consume(self, events):
+        while True:
+            try:
+                self.apply(events.get())
+            except Exception as e:
+                logger.warning(f"Invalid status event: {str(e)}")
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            # Workers killed in the middle of an attempt never report its end
+            for _id in [i for i, e in self._in_flight.items() if not pid_alive(e["pid"])]:
+                del self._in_flight[_id]
+            attempts = [
+                {
+                    "attempt_id": _id,
+                    "pid": entry["pid"],
+                    "phase": entry["phase"],
+                    "elapsed": round(now - entry["started"], 3),
+                    "phase_elapsed": round(now - entry["phase_started"], 3),
+                }
+                for _id, entry in self._in_flight.items()
+            ]
+            latencies = np.array(self._latencies)
+            results = dict(self._results)
+            latency_count, latency_sum = self._latency_count, self._latency_sum
+            workers = self._workers
+        busy = len({attempt["pid"] for attempt in attempts})
+        return {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "jobs": [
+                {
+                    "id": job.id,
+                    "name": job.name,
+                    "next_run_time": job.next_run_time and job.next_run_time.isoformat(),
+                }
+                for job in (self.scheduler.get_jobs() if self.scheduler else [])
+            ],
+            "queue": self.work_queue.counts() if self.work_queue else {},
+            "pool": {
+                "workers": workers,
+                "busy": busy,
+                "utilisation": round(busy / workers, 3) if workers else 0,
+            },
+            "sessions": sum(attempt["phase"] not in SEARCH_PHASES for attempt in attempts),
+            "attempts": attempts,
+            "results": results,
+            # Percentiles of the last LATENCY_WINDOW attempts, count and sum of all of them
+            "latency": {
+                "count": latency_count,
+                "sum": round(latency_sum, 3),
+                **{
+                    f"p{q * 100:g}": (
+                        round(float(np.quantile(latencies, q)), 3) if len(latencies) else None
+                    )
+                    for q in QUANTILES
+                },
+            },
+        }
+
+
+def to_prometheus(snapshot):
+    """Render a snapshot of the StatusBoard in the Prometheus text exposition format."""
+    metrics = {
+        "rainbot_job_next_run_timestamp_seconds": (
+            "gauge",
+            [
+                (
+                    {"id": job["id"], "name": job["name"]},
+                    datetime.fromisoformat(job["next_run_time"]).timestamp(),
+                )
+                for job in snapshot["jobs"]
+                if job["next_run_time"]
+            ],
+        ),
+        "rainbot_queue_items": (
+            "gauge",
+            [({"status": status}, count) for status, count in snapshot["queue"].items()],
+        ),
+        "rainbot_pool_workers": ("gauge", [({}, snapshot["pool"]["workers"])]),
+        "rainbot_pool_busy_workers": ("gauge", [({}, snapshot["pool"]["busy"])]),
+        "rainbot_browser_sessions": ("gauge", [({}, snapshot["sessions"])]),
+        "rainbot_attempts_in_flight": (
+            "gauge",
+            [
+                ({"phase": phase}, count)
+                for phase, count in Counter(a["phase"] for a in snapshot["attempts"]).items()
+            ],
+        ),
+        "rainbot_attempt_oldest_seconds": (
+            "gauge",
+            [({}, max((a["elapsed"] for a in snapshot["attempts"]), default=0))],
+        ),
+        "rainbot_attempts_total": (
+            "counter",
+            [({"result": result}, count) for result, count in snapshot["results"].items()],
+        ),
+        "rainbot_attempt_latency_seconds": (
+            "summary",
+            [
+                ({"quantile": f"{q:g}"}, snapshot["latency"][f"p{q * 100:g}"])
+                for q in QUANTILES
+                if snapshot["latency"][f"p{q * 100:g}"] is not None
+            ]
+            + [({}, snapshot["latency"][total]) for total in ["sum", "count"]],
+        ),
+    }
+    lines = []
+    for name, (kind, samples) in metrics.items():
+        lines.append(f"# TYPE {name} {kind}")
+        totals = iter(["_sum", "_count"])
+        for labels, value in samples:
+            # The samples of a summary without labels are its sum and count
+            suffix = next(totals) if kind == "summary" and not labels else ""
+            label = ",".join(f'{key}="{value}"' for key, value in labels.items())
+            lines.append(
+                f"{name}{suffix}{{{label}}} {value}" if label else f"{name}{suffix} {value}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path in ["/", "/status"]:
+            body = json.dumps(self.server.board.snapshot(), indent=2).encode()
+            content_type = "application/json"
+        elif self.path == "/metrics":
+            body = to_prometheus(self.server.board.snapshot()).encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(scheduler=None, work_queue=None):
+    """
+    Serve the state of the scheduler on STATUS_PORT: JSON on /status and Prometheus metrics on
+    /metrics. Must be called before the workers are forked so that they inherit the event queue.
+
+    Args:
+        scheduler (apscheduler.schedulers.base.BaseScheduler): scheduler whose jobs are listed
+        work_queue (src.work_queue.WorkQueue): queue whose items are counted
+
+    Returns:
+        ThreadingHTTPServer: the running server, None when disabled or the port is taken
+    """
+    global _board
+    if not STATUS_PORT:
+        return None
+    try:
+        server = ThreadingHTTPServer((STATUS_HOST, STATUS_PORT), StatusHandler)
+    except OSError as e:
+        logger.warning(f"Status endpoint not started: {str(e)}")
+        return None
+    _board = server.board = StatusBoard(scheduler, work_queue)
+    attach_events(mp.Queue(-1))
+    threading.Thread(target=_board.consume, args=(_events,), daemon=True).start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Status served on http://{STATUS_HOST}:{STATUS_PORT}/status")
+    return server
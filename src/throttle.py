@@ -0,0 +1,175 @@
+import functools
+import os
+import random
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+from src.utils import state_path
+
+# Token bucket of each upstream: (requests per second, burst)
+UPSTREAMS = {
+    "booking": (float(os.getenv("BOOKING_RATE", 5)), 10),
+    "sheets": (float(os.getenv("SHEETS_RATE", 1)), 10),
+    "captcha": (float(os.getenv("CAPTCHA_RATE", 1)), 5),
+    "smtp": (float(os.getenv("SMTP_RATE", 1)), 5),
+}
+MAX_WAIT = float(os.getenv("THROTTLE_MAX_WAIT", 5))
+FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class ThrottledError(UpstreamUnavailable):
+    pass
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class Throttle:
+    """
+    Rate limiter and circuit breaker per upstream, shared by all the processes of the host.
+
+    The state lives in a SQLite file so that forked workers and separate worker processes draw
+    from the same token buckets and see the same breakers.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): database file, defaults to throttle.sqlite3 in the state directory
+        """
+        self.path = path or state_path("throttle.sqlite3")
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(upstream TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS breakers "
+                "(upstream TEXT PRIMARY KEY, failures INTEGER NOT NULL, opened_until REAL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def acquire(self, upstream, max_wait=MAX_WAIT):
+        """Take a token from the bucket of upstream, raise ThrottledError if none comes in time."""
+        rate, burst = UPSTREAMS[upstream]
+        deadline = time.time() + max_wait
+        while True:
+            with self._transaction() as connection:
+                now = time.time()
+                row = connection.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE upstream = ?", (upstream,)
+                ).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / rate
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                    (upstream, tokens - 1 if not wait else tokens, now),
+                )
+            if not wait:
+                return
+            if now + wait > deadline:
+                raise ThrottledError(f"Rate limit of {upstream} exceeded")
+            time.sleep(wait)
+
+    def check_circuit(self, upstream):
+        """
+        Raise CircuitOpenError while the breaker of upstream is open. Once it times out, a single
+        caller is let through to probe the upstream while the others keep failing fast.
+        """
+        with self._transaction() as connection:
+            now = time.time()
+            row = connection.execute(
+                "SELECT opened_until FROM breakers WHERE upstream = ?", (upstream,)
+            ).fetchone()
+            if row is None or row[0] is None:
+                return
+            if now < row[0]:
+                raise CircuitOpenError(f"Circuit of {upstream} is open")
+            connection.execute(
+                "UPDATE breakers SET opened_until = ? WHERE upstream = ?",
+                (now + RESET_TIMEOUT, upstream),
+            )
+
+    def record_success(self, upstream):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE breakers SET failures = 0, opened_until = NULL "
+                "WHERE upstream = ? AND (failures > 0 OR opened_until IS NOT NULL)",
+                (upstream,),
+            )
+
+    def record_failure(self, upstream):
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT failures FROM breakers WHERE upstream = ?", (upstream,)
+            ).fetchone()
+            failures = (row[0] if row else 0) + 1
+            connection.execute(
+                "INSERT OR REPLACE INTO breakers VALUES (?, ?, ?)",
+                (
+                    upstream,
+                    failures,
+                    time.time() + RESET_TIMEOUT if failures >= FAILURE_THRESHOLD else None,
+                ),
+            )
+
+    def call(self, upstream, func, *args, retries=2, retry_on=(OSError,), **kwargs):
+        """
+        Call func once the upstream allows it, retrying with jittered exponential backoff.
+
+        Args:
+            upstream (str): key of UPSTREAMS
+            func (callable): function calling the upstream
+            retries (int): number of retries after the first attempt
+            retry_on (tuple): exceptions counting as upstream failures, the other ones are raised
+                as is
+
+        Raises:
+            UpstreamUnavailable: when the breaker is open or the rate limit is exceeded
+        """
+        for attempt in range(retries + 1):
+            self.check_circuit(upstream)
+            self.acquire(upstream)
+            try:
+                result = func(*args, **kwargs)
+            except retry_on:
+                self.record_failure(upstream)
+                if attempt == retries:
+                    raise
+                time.sleep(random.uniform(0, 0.5 * 2**attempt))
+            else:
+                self.record_success(upstream)
+                return result
+
+
+throttle = Throttle(os.getenv("THROTTLE_PATH"))
+
+
+def throttled(upstream, **call_kwargs):
+    """Decorate a function so that all its calls go through throttle.call."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return throttle.call(upstream, func, *args, **call_kwargs, **kwargs)
+
+        return wrapper
+
+    return decorator
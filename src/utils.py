@@ -1,4 +1,7 @@
 import datetime
+import os
+
+STATE_DIR = os.getenv("STATE_DIR", ".rainbot")
 
 
 def date_of_next_day(day_code):
@@ -14,3 +17,42 @@ def date_of_next_day(day_code):
     return (today + datetime.timedelta(days=(day_code - today.weekday() + 7) % 7)).strftime(
         "%d/%m/%Y"
     )
+
+
+def state_path(name):
+    """
+    Return the path of a file kept in the local state directory, creating the directory if needed
+    Args:
+        name (str): file name relative to STATE_DIR
+
+    Returns:
+        str: the path of the file
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def memory_usage(pid="self"):
+    """
+    Return the memory used by a process, read from /proc (Linux only)
+    Args:
+        pid (int | str): process id, defaults to the current process
+
+    Returns:
+        dict: rss, pss and uss in bytes, empty if not available. uss only counts the pages
+        private to the process, i.e. not shared with its parent after a fork
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            fields = {
+                line.split(":")[0]: int(line.split()[1]) * 1024
+                for line in smaps
+                if line.split(":")[0] in ["Rss", "Pss", "Private_Clean", "Private_Dirty"]
+            }
+    except (FileNotFoundError, PermissionError):
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
@@ -0,0 +1,203 @@
+import hashlib
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import closing
+from typing import NamedTuple
+
+from src.utils import state_path
+
+
+class Lease(NamedTuple):
+    item_id: str
+    payload: str
+    worker_id: str
+    expires_at: float
+
+
+def owner(shard_key, workers):
+    """
+    Return the worker in charge of shard_key using rendezvous hashing.
+
+    Every worker computes the same owner from the same set of live workers, and only the keys
+    of a worker that joins or leaves move to another one.
+    """
+    return max(
+        workers,
+        key=lambda worker_id: hashlib.blake2b(
+            f"{worker_id}:{shard_key}".encode(), digest_size=8
+        ).digest(),
+        default=None,
+    )
+
+
+def heartbeat_interval(lease_ttl, worker_ttl):
+    """
+    Seconds between the heartbeats of a busy worker, frequent enough to keep both its lease and
+    its registration alive: a worker silent for worker_ttl loses its shards to the others.
+    """
+    return min(lease_ttl, worker_ttl) / 3
+
+
+class WorkQueue(ABC):
+    """
+    Queue of booking requests shared by several worker processes, possibly on several hosts.
+
+    Items are leased for a limited time: a worker must heartbeat its lease while working on it,
+    otherwise the item becomes available again once the lease expires. Items are sharded by key
+    so that all the items of a key are handled by the same live worker, and never by two workers
+    at once.
+    """
+
+    @abstractmethod
+    def put(self, item_id, shard_key, payload):
+        """Enqueue an item, or requeue it if it is done. Items currently leased are left as is."""
+
+    @abstractmethod
+    def register(self, worker_id):
+        """Mark worker_id as alive so that shards get assigned to it."""
+
+    @abstractmethod
+    def lease(self, worker_id, ttl):
+        """Return the next Lease owned by worker_id, or None if there is nothing to do."""
+
+    @abstractmethod
+    def heartbeat(self, lease, ttl):
+        """Extend the lease, return False if it has been lost to another worker."""
+
+    @abstractmethod
+    def complete(self, lease):
+        """Mark the leased item as done."""
+
+    @abstractmethod
+    def counts(self):
+        """Return the number of items by status."""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    WorkQueue backed by a SQLite file, for workers sharing a host or a file system.
+    """
+
+    def __init__(self, path=None, worker_ttl=30):
+        """
+        Args:
+            path (str): database file, defaults to queue.sqlite3 in the state directory
+            worker_ttl (float): seconds after which a silent worker is considered dead
+        """
+        self.path = path or state_path("queue.sqlite3")
+        self.worker_ttl = worker_ttl
+        with closing(self._connect()) as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS items (
+                    item_id TEXT PRIMARY KEY,
+                    shard_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    enqueued_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    seen_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _connect(self):
+        # SQLite connections must not cross a fork, each operation opens its own
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def put(self, item_id, shard_key, payload):
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute(
+                """
+                INSERT INTO items (item_id, shard_key, payload, status, enqueued_at)
+                VALUES (?, ?, ?, 'pending', ?)
+                ON CONFLICT (item_id) DO UPDATE SET
+                    shard_key = excluded.shard_key,
+                    payload = excluded.payload,
+                    status = 'pending',
+                    worker_id = NULL,
+                    lease_expires = NULL,
+                    enqueued_at = excluded.enqueued_at
+                WHERE items.status != 'leased' OR items.lease_expires < ?
+                """,
+                (item_id, shard_key, payload, now, now),
+            )
+
+    def register(self, worker_id):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO workers VALUES (?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET seen_at = excluded.seen_at",
+                (worker_id, time.time()),
+            )
+
+    def lease(self, worker_id, ttl):
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            workers = [
+                row[0]
+                for row in connection.execute(
+                    "SELECT worker_id FROM workers WHERE seen_at >= ?", (now - self.worker_ttl,)
+                )
+            ]
+            # Ownership moves when workers join or leave: a key stays with the worker holding a
+            # lease on it until that lease is completed or expires
+            candidates = connection.execute(
+                """
+                SELECT item_id, shard_key, payload FROM items
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                AND shard_key NOT IN (
+                    SELECT shard_key FROM items
+                    WHERE status = 'leased' AND lease_expires >= ? AND worker_id != ?
+                )
+                ORDER BY enqueued_at
+                """,
+                (now, now, worker_id),
+            ).fetchall()
+            for item_id, shard_key, payload in candidates:
+                if owner(shard_key, workers) != worker_id:
+                    continue
+                connection.execute(
+                    "UPDATE items SET status = 'leased', worker_id = ?, lease_expires = ? "
+                    "WHERE item_id = ?",
+                    (worker_id, now + ttl, item_id),
+                )
+                connection.execute("COMMIT")
+                return Lease(item_id, payload, worker_id, now + ttl)
+            connection.execute("COMMIT")
+            return None
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def heartbeat(self, lease, ttl):
+        self.register(lease.worker_id)
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE items SET lease_expires = ? "
+                "WHERE item_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time() + ttl, lease.item_id, lease.worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, lease):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE items SET status = 'done', lease_expires = NULL "
+                "WHERE item_id = ? AND worker_id = ? AND status = 'leased'",
+                (lease.item_id, lease.worker_id),
+            )
+
+    def counts(self):
+        with closing(self._connect()) as connection:
+            return dict(connection.execute("SELECT status, COUNT(*) FROM items GROUP BY status"))
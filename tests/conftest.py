@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Keep the state files of the modules under test out of the working directory
+os.environ.setdefault("STATE_DIR", tempfile.mkdtemp(prefix="rainbot-tests-"))
+# Settings read at import by src.booking_service
+for name in ["BOOKING_URL", "LOGIN_URL", "AUTH_BASE_URL", "ACCOUNT_BASE_URL", "CAPTCHA_URL"]:
+    os.environ.setdefault(name, "https://tennis.example.com/")
+os.environ.setdefault("CAPTCHA_API_KEY", "test")
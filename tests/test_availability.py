@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from src import availability
+from src.availability import AvailabilityCache, query_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(availability.time, "time", clock)
+    monkeypatch.setattr(availability, "AVAILABILITY_TTL", 12)
+    monkeypatch.setattr(availability, "AVAILABILITY_EMPTY_TTL", 1)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return AvailabilityCache(str(tmp_path / "availability.cache"), slots=16, slot_size=256)
+
+
+def test_query_key_ignores_the_order_and_spelling_of_places():
+    assert query_key(["Élisabeth", "Suzanne Lenglen"], "01/06/2024", ["V", "F"], "8", 10) == (
+        query_key(["suzanne-lenglen", "ELISABETH"], "01/06/2024", ["F", "V"], 8, "10", "extra")
+    )
+    assert query_key(["Élisabeth"], "01/06/2024", None, 8, 10) != query_key(
+        ["Élisabeth"], "01/06/2024", None, 9, 10
+    )
+
+
+def test_results_expire_and_empty_ones_sooner(cache, clock):
+    courts, no_courts = query_key(["A"], "d", None, 8, 10), query_key(["B"], "d", None, 8, 10)
+    assert cache.get(courts) is None
+    cache.put(courts, [("A", 8), ("A", 9)])
+    cache.put(no_courts, [])
+    assert cache.get(courts) == [("A", 8), ("A", 9)]
+    assert cache.get(no_courts) == []
+
+    clock.now += 2
+    assert cache.get(courts) == [("A", 8), ("A", 9)]
+    assert cache.get(no_courts) is None
+    clock.now += 11
+    assert cache.get(courts) is None
+
+
+def test_invalidate_drops_the_result_of_the_query_only(cache):
+    first, second = query_key(["A"], "d", None, 8, 10), query_key(["A"], "d", None, 10, 12)
+    cache.put(first, [("A", 8)])
+    cache.put(second, [("A", 10)])
+    cache.invalidate(first)
+    assert cache.get(first) is None
+    assert cache.get(second) == [("A", 10)]
+
+
+def test_results_too_large_for_a_slot_are_not_cached(cache):
+    key = query_key(["A"], "d", None, 8, 22)
+    cache.put(key, [(f"Place {i}", hour) for i in range(20) for hour in range(8, 22)])
+    assert cache.get(key) is None
+
+
+def test_forked_process_sees_and_shares_the_cache(cache):
+    key = query_key(["A"], "d", None, 8, 10)
+    cache.put(key, [("A", 8)])
+    pid = os.fork()
+    if pid == 0:
+        # Exit without running the rest of the test session in the child
+        if cache.get(key) != [("A", 8)]:
+            os._exit(1)
+        cache.put(key, [("A", 9)])
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert cache.get(key) == [("A", 9)]
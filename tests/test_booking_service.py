@@ -0,0 +1,37 @@
+import json
+from types import SimpleNamespace
+
+from src import booking_service
+from src.booking_service import BookingService, chrome_arguments
+
+
+def test_lean_browser_arguments(monkeypatch):
+    monkeypatch.setattr(booking_service, "LEAN_BROWSER", False)
+    assert "--window-size=1920,1080" in chrome_arguments()
+    monkeypatch.setattr(booking_service, "LEAN_BROWSER", True)
+    arguments = chrome_arguments()
+    assert "--window-size=1280,800" in arguments
+    assert "--disable-extensions" in arguments
+    assert "--no-sandbox" in arguments
+
+
+def test_blocked_urls_only_block_images_of_the_booking_site():
+    assert "*tennis.example.com*.png" in booking_service.BLOCKED_URLS
+    assert not any(pattern.endswith(".js") for pattern in booking_service.BLOCKED_URLS)
+
+
+def test_network_usage_counts_loaded_and_blocked_requests():
+    def entry(method, **params):
+        return {"message": json.dumps({"message": {"method": method, "params": params}})}
+
+    service = BookingService.__new__(BookingService)
+    service.driver = SimpleNamespace(
+        get_log=lambda _: [
+            entry("Network.loadingFinished", encodedDataLength=1000),
+            entry("Network.loadingFinished", encodedDataLength=24),
+            entry("Network.loadingFailed", blockedReason="inspector"),
+            entry("Network.loadingFailed", errorText="net::ERR_ABORTED"),
+            entry("Network.requestWillBeSent"),
+        ]
+    )
+    assert service.network_usage() == {"requests": 2, "bytes": 1024, "blocked_requests": 1}
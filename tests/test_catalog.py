@@ -0,0 +1,19 @@
+import pandas as pd
+
+from src.catalog import contiguous_runs, diff_catalog
+
+
+def test_diff_catalog_compares_rows_by_key_whatever_their_type_and_order():
+    previous = pd.DataFrame({"id": [1, 2, 3], "name": ["a", "b", None]})
+    current = pd.DataFrame({"id": ["4", "3", "2"], "name": ["d", "", "B"]})
+    diff = diff_catalog(previous, current, "id")
+    assert list(diff.added) == ["4"]
+    assert list(diff.changed) == ["2"]
+    assert list(diff.removed) == ["1"]
+    assert str(diff) == "1 added, 1 changed, 1 removed"
+    assert diff_catalog(previous, previous, "id").is_empty
+
+
+def test_contiguous_runs():
+    assert contiguous_runs([]) == []
+    assert contiguous_runs([2, 3, 4, 7, 9, 10]) == [(2, 4), (7, 7), (9, 10)]
@@ -0,0 +1,31 @@
+import pytest
+
+from src.outcomes import OutcomeStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutcomeStore(str(tmp_path / "outcomes.sqlite3"))
+
+
+def record(store, place, hour, *results):
+    for result in results:
+        store.record(result, 1.0, "user", place, hour)
+
+
+def test_rank_puts_the_slots_won_most_often_first(store):
+    record(store, "A", 8, "lost", "lost", "lost")
+    record(store, "B", 8, "booked", "booked", "lost")
+    record(store, "C", 8, "booked", "lost")
+    assert store.rank([("A", 8), ("B", 8), ("C", 8)]) == [("B", 8), ("C", 8), ("A", 8)]
+    # Never raced, at the overall rate
+    assert store.rank([("A", 8), ("D", 8), ("B", 8)]) == [("B", 8), ("D", 8), ("A", 8)]
+
+
+def test_errors_and_unraced_results_do_not_lower_a_slot(store):
+    record(store, "A", 8, "booked", "lost")
+    record(store, "B", 8, "booked", "lost", "error", "error", "no_court", "already_booked")
+    rates = store.success_rates()
+    assert rates.loc[("B", 8)].attempts == 2
+    assert rates.loc[("A", 8)].rate == rates.loc[("B", 8)].rate
+    assert store.rank([("B", 8), ("A", 8)]) == [("B", 8), ("A", 8)]
@@ -0,0 +1,17 @@
+from src.places import PlaceIndex, normalise
+
+
+def test_normalise_ignores_case_accents_spaces_and_punctuation():
+    assert normalise("Élisabeth - Paris 14") == "elisabethparis14"
+
+
+def test_resolve_by_name_normalised_name_or_id():
+    index = PlaceIndex(["Elisabeth", "Suzanne Lenglen"], [328, ""])
+    assert index.resolve("Suzanne Lenglen") == "Suzanne Lenglen"
+    assert index.resolve("SuzanneLenglen") == "Suzanne Lenglen"
+    assert index.resolve("élisabeth") == "Elisabeth"
+    assert index.resolve(328) == "Elisabeth"
+    assert index.resolve("Atlantique") is None
+    assert "suzanne lenglen" in index
+    assert index.id("Elisabeth") == 328
+    assert index.id("Suzanne Lenglen") is None
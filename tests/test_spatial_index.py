@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from src.spatial_index import SpatialIndex
+
+
+@pytest.fixture
+def index():
+    tennis = pd.DataFrame(
+        {
+            "nomSrtm": ["Elisabeth", "Didot", "Atlantique", "Nowhere"],
+            "gpsLat": [48.8268, 48.8322, 48.8400, ""],
+            "gpsLon": [2.3286, 2.3180, 2.3190, ""],
+        }
+    )
+    return SpatialIndex.from_catalog(tennis)
+
+
+def test_places_without_coordinates_are_left_out(index):
+    assert index.names.tolist() == ["Elisabeth", "Didot", "Atlantique"]
+
+
+def test_nearest_ranks_places_within_the_radius_closest_first(index):
+    assert index.nearest(
+        ["elisabeth", "48.8322,2.3180", "Nowhere", "Atlantique"], [1, 0.1, 5, 0]
+    ) == [
+        ["Elisabeth", "Didot"],
+        ["Didot"],
+        [],
+        ["Atlantique"],
+    ]
+
+
+def test_distances_are_great_circle_kilometres(index):
+    distances = index.distances([48.8268], [2.3286])
+    assert distances[0, 0] == pytest.approx(0)
+    assert distances[0, 2] == pytest.approx(1.63, abs=0.01)
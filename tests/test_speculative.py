@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.speculative import Race
+
+
+def test_first_claim_wins_and_the_others_lose():
+    race = Race()
+    first, second = object(), object()
+    assert not race.is_lost(first)
+    assert not race.is_lost(second)
+    assert race.claim(first)
+    assert race.claim(first)
+    assert not race.claim(second)
+    assert not race.is_lost(first)
+    assert race.is_lost(second)
+
+
+def test_a_single_attempt_wins_concurrent_claims():
+    race = Race()
+    attempts = [object() for _ in range(32)]
+    with ThreadPoolExecutor(8) as executor:
+        won = list(executor.map(race.claim, attempts))
+    assert sum(won) == 1
+    assert [race.is_lost(attempt) for attempt in attempts] == [not w for w in won]
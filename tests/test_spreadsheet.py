@@ -0,0 +1,147 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+import requests
+from gspread.utils import a1_to_rowcol
+
+from src import spreadsheet
+from src.spreadsheet import DriveClient
+from src.throttle import Throttle
+
+
+class FakeWorksheet:
+    """Worksheet holding its values in memory, with the calls made by the catalog sync."""
+
+    title = "Tennis"
+    id = 0
+
+    def __init__(self, values):
+        self.values = [list(row) for row in values]
+        self.spreadsheet = self
+        self.fail_on = None
+
+    def _check(self, method):
+        if self.fail_on == method:
+            raise requests.ConnectionError(f"{method} failed")
+
+    def get_all_values(self):
+        return [list(row) for row in self.values]
+
+    def update(self, values):
+        self.values = [list(row) for row in values]
+
+    def batch_update(self, body):
+        if isinstance(body, dict):
+            self._check("delete")
+            for request in body["requests"]:
+                rows = request["deleteDimension"]["range"]
+                del self.values[rows["startIndex"] : rows["endIndex"]]
+            return
+        self._check("update")
+        for value_range in body:
+            first, last = (a1_to_rowcol(cell)[0] for cell in value_range["range"].split(":"))
+            self.values[first - 1 : last] = value_range["values"]
+
+    def batch_get(self, ranges):
+        value_ranges = []
+        for value_range in ranges:
+            row, col = a1_to_rowcol(value_range.split(":")[0])
+            cells = [values[col - 1 : col] for values in self.values[row - 1 :]]
+            # Trailing empty cells are not returned
+            while cells and cells[-1] in ([], [""]):
+                cells.pop()
+            value_ranges.append(cells)
+        return value_ranges
+
+    def append_rows(self, values, **_):
+        self._check("append")
+        self.values += values
+
+
+@pytest.fixture
+def worksheet():
+    return FakeWorksheet([["id", "name"], ["1", "a"], ["2", "b"], ["3", "c"], ["4", "d"]])
+
+
+@pytest.fixture
+def client(worksheet, tmp_path, monkeypatch):
+    monkeypatch.setattr(spreadsheet, "throttle", Throttle(str(tmp_path / "throttle.sqlite3")))
+    monkeypatch.setattr(spreadsheet, "state_path", lambda name: str(tmp_path / name))
+    client = DriveClient.__new__(DriveClient)
+    client._client = SimpleNamespace(auth=SimpleNamespace(token="token", expiry=datetime.max))
+    client._worksheets = [worksheet]
+    client._headers = {"Tennis": ["id", "name"]}
+    client._headers_loaded_at = time.monotonic()
+    client._watermarks = {}
+    client._watermarks_path = str(tmp_path / "watermarks.json")
+    return client
+
+
+def catalog(*rows):
+    return pd.DataFrame(rows, columns=["id", "name"])
+
+
+def test_sync_writes_changed_removed_and_added_rows(client, worksheet):
+    # The first sync diffs against the sheet and leaves a snapshot for the next ones
+    diff = client.sync_sheet_from_dataframe("Tennis", catalog(*worksheet.values[1:]), key="id")
+    assert diff.is_empty
+
+    diff = client.sync_sheet_from_dataframe(
+        "Tennis", catalog(["1", "a"], ["2", "B"], ["4", "D"], ["5", "e"]), key="id"
+    )
+    assert list(diff.changed) == ["2", "4"]
+    assert list(diff.removed) == ["3"]
+    assert list(diff.added) == ["5"]
+    assert worksheet.values == [["id", "name"], ["1", "a"], ["2", "B"], ["4", "D"], ["5", "e"]]
+
+    worksheet.fail_on = "update"
+    diff = client.sync_sheet_from_dataframe(
+        "Tennis", catalog(["1", "a"], ["2", "B"], ["4", "D"], ["5", "e"]), key="id"
+    )
+    assert diff.is_empty
+
+
+def test_failed_sync_diffs_against_the_sheet_on_the_next_run(client, worksheet):
+    client.sync_sheet_from_dataframe("Tennis", catalog(*worksheet.values[1:]), key="id")
+
+    # The deletion goes through, the append does not
+    worksheet.fail_on = "append"
+    with pytest.raises(requests.ConnectionError):
+        client.sync_sheet_from_dataframe(
+            "Tennis", catalog(["1", "a"], ["3", "c"], ["4", "d"], ["5", "e"]), key="id"
+        )
+    assert worksheet.values == [["id", "name"], ["1", "a"], ["3", "c"], ["4", "d"]]
+
+    worksheet.fail_on = None
+    diff = client.sync_sheet_from_dataframe(
+        "Tennis", catalog(["1", "a"], ["3", "c"], ["4", "D"], ["5", "e"]), key="id"
+    )
+    assert list(diff.changed) == ["4"]
+    assert list(diff.removed) == []
+    assert list(diff.added) == ["5"]
+    assert worksheet.values == [["id", "name"], ["1", "a"], ["3", "c"], ["4", "D"], ["5", "e"]]
+
+
+def test_sync_rewrites_the_sheet_when_columns_change(client, worksheet):
+    data = pd.DataFrame({"id": ["1", "2"], "name": ["a", "b"], "surface": ["clay", "grass"]})
+    diff = client.sync_sheet_from_dataframe("Tennis", data, key="id")
+    assert list(diff.added) == ["1", "2"]
+    assert worksheet.values == [["id", "name", "surface"], ["1", "a", "clay"], ["2", "b", "grass"]]
+
+
+def test_new_rows_are_read_again_until_their_watermark_is_committed(client, worksheet):
+    rows, watermark = client.read_new_rows("Tennis", ["name"])
+    assert rows.name.to_list() == ["a", "b", "c", "d"]
+    assert watermark == 5
+    # Saving the rows failed, the watermark was not committed
+    rows, watermark = client.read_new_rows("Tennis", ["name"])
+    assert len(rows) == 4
+
+    client.commit_watermark("Tennis", watermark)
+    worksheet.append_rows([["5", "e"]])
+    rows, watermark = client.read_new_rows("Tennis", ["id", "name"])
+    assert rows.to_dict("records") == [{"id": 5, "name": "e"}]
+    assert watermark == 6
@@ -0,0 +1,22 @@
+from src.status import StatusBoard, to_prometheus
+
+
+def test_done_events_close_attempts_and_feed_the_latency_summary():
+    board = StatusBoard()
+    board.add_workers(2)
+    board.apply(("phase", "a1", 1, "searching", 0.0))
+    board.apply(("phase", "a1", 1, "login", 1.0))
+    assert [attempt["phase"] for attempt in board.snapshot()["attempts"]] == ["login"]
+    for latency in [1.0, 2.0, 4.0]:
+        board.apply(("done", "a1", 1, "booked", latency))
+
+    snapshot = board.snapshot()
+    assert snapshot["attempts"] == []
+    assert snapshot["results"] == {"booked": 3}
+    assert snapshot["latency"]["count"] == 3
+    assert snapshot["latency"]["sum"] == 7.0
+    metrics = to_prometheus(snapshot).splitlines()
+    assert 'rainbot_attempt_latency_seconds{quantile="0.5"} 2.0' in metrics
+    assert "rainbot_attempt_latency_seconds_sum 7.0" in metrics
+    assert "rainbot_attempt_latency_seconds_count 3" in metrics
+    assert "rainbot_pool_workers 2" in metrics
@@ -0,0 +1,80 @@
+import pytest
+
+from src import throttle as throttle_module
+from src.throttle import (
+    FAILURE_THRESHOLD,
+    RESET_TIMEOUT,
+    CircuitOpenError,
+    Throttle,
+    ThrottledError,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle_module.time, "time", clock.time)
+    monkeypatch.setattr(throttle_module.time, "sleep", clock.sleep)
+    monkeypatch.setitem(throttle_module.UPSTREAMS, "test", (2.0, 3))
+    return clock
+
+
+@pytest.fixture
+def throttle(tmp_path, clock):
+    return Throttle(str(tmp_path / "throttle.sqlite3"))
+
+
+def test_bucket_allows_a_burst_then_the_rate(throttle, clock):
+    for _ in range(3):
+        throttle.acquire("test")
+    assert clock.now == 1_000_000.0
+    throttle.acquire("test")
+    assert clock.now == pytest.approx(1_000_000.5)
+    with pytest.raises(ThrottledError):
+        throttle.acquire("test", max_wait=0.1)
+
+
+def test_breaker_opens_after_repeated_failures_then_lets_one_probe_through(throttle, clock):
+    for _ in range(FAILURE_THRESHOLD):
+        throttle.check_circuit("test")
+        throttle.record_failure("test")
+    with pytest.raises(CircuitOpenError):
+        throttle.check_circuit("test")
+
+    clock.now += RESET_TIMEOUT + 1
+    # Half open: the first caller probes the upstream, the others still fail fast
+    throttle.check_circuit("test")
+    with pytest.raises(CircuitOpenError):
+        throttle.check_circuit("test")
+    throttle.record_success("test")
+    throttle.check_circuit("test")
+
+
+def test_call_retries_the_given_errors_only(throttle):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert throttle.call("test", flaky, retries=2) == "ok"
+    assert len(calls) == 3
+
+    def broken():
+        raise ValueError("not an upstream failure")
+
+    with pytest.raises(ValueError):
+        throttle.call("test", broken, retries=2)
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+from src.utils import memory_usage
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+def test_memory_usage_of_a_live_process():
+    usage = memory_usage()
+    assert set(usage) == {"rss", "pss", "uss"}
+    assert 0 < usage["uss"] <= usage["rss"]
+    assert memory_usage(os.getpid())["rss"] > 0
+
+
+def test_memory_usage_of_a_missing_process_is_empty():
+    # Above the maximum pid of Linux
+    assert memory_usage(2**23) == {}
@@ -0,0 +1,104 @@
+import pytest
+
+from src import work_queue
+from src.work_queue import SQLiteWorkQueue, heartbeat_interval, owner
+
+LEASE_TTL = 120
+WORKER_TTL = 30
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return SQLiteWorkQueue(str(tmp_path / "queue.sqlite3"), worker_ttl=WORKER_TTL)
+
+
+def key_owned_by(worker_id, workers):
+    return next(f"user-{i}" for i in range(1000) if owner(f"user-{i}", workers) == worker_id)
+
+
+def test_owner_is_stable_and_only_moves_keys_of_a_leaving_worker():
+    keys = [f"user-{i}" for i in range(200)]
+    before = {key: owner(key, ["w1", "w2", "w3"]) for key in keys}
+    after = {key: owner(key, ["w3", "w1"]) for key in keys}
+    assert set(before.values()) == {"w1", "w2", "w3"}
+    assert all(after[key] == before[key] for key in keys if before[key] != "w2")
+    assert owner("user-0", []) is None
+
+
+def test_lease_only_returns_items_of_owned_shards(queue):
+    queue.register("w1")
+    queue.register("w2")
+    queue.put("r1", key_owned_by("w1", ["w1", "w2"]), "{}")
+    assert queue.lease("w2", LEASE_TTL) is None
+    lease = queue.lease("w1", LEASE_TTL)
+    assert lease.item_id == "r1"
+    assert queue.lease("w1", LEASE_TTL) is None
+
+
+def test_expired_lease_is_taken_over_and_heartbeat_reports_the_loss(queue, clock):
+    queue.register("w1")
+    queue.put("r1", "u1", "{}")
+    lease = queue.lease("w1", LEASE_TTL)
+    clock.now += LEASE_TTL + 1
+    queue.register("w2")
+    # w1 went silent, its shards moved to w2
+    taken = queue.lease("w2", LEASE_TTL)
+    assert taken.item_id == "r1"
+    assert not queue.heartbeat(lease, LEASE_TTL)
+    assert queue.heartbeat(taken, LEASE_TTL)
+
+
+def test_busy_worker_keeps_its_shards_between_heartbeats(queue, clock):
+    queue.register("w1")
+    queue.register("w2")
+    user = key_owned_by("w1", ["w1", "w2"])
+    queue.put("r1", user, "{}")
+    lease = queue.lease("w1", LEASE_TTL)
+    queue.put("r2", user, "{}")
+    interval = heartbeat_interval(LEASE_TTL, WORKER_TTL)
+    assert interval < WORKER_TTL
+    for _ in range(6):
+        clock.now += interval
+        queue.register("w2")
+        assert queue.heartbeat(lease, LEASE_TTL)
+        # w1 is still working on r1, the other request of its user must wait for it
+        assert queue.lease("w2", LEASE_TTL) is None
+
+
+def test_worker_joining_mid_lease_waits_for_the_lease_on_its_keys(queue):
+    queue.register("w1")
+    # A key that moves to w2 once it joins
+    user = key_owned_by("w2", ["w1", "w2"])
+    queue.put("r1", user, "{}")
+    lease = queue.lease("w1", LEASE_TTL)
+    queue.put("r2", user, "{}")
+    queue.register("w2")
+    assert queue.lease("w2", LEASE_TTL) is None
+    queue.complete(lease)
+    assert queue.lease("w2", LEASE_TTL).item_id == "r2"
+
+
+def test_completed_item_can_be_requeued(queue):
+    queue.register("w1")
+    queue.put("r1", "u1", "{}")
+    lease = queue.lease("w1", LEASE_TTL)
+    queue.put("r1", "u1", '{"updated": true}')
+    assert queue.counts() == {"leased": 1}
+    queue.complete(lease)
+    queue.put("r1", "u1", '{"updated": true}')
+    assert queue.lease("w1", LEASE_TTL).payload == '{"updated": true}'